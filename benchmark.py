@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import contextlib
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+from make_dataframe import make_df
+from extract import extract_trajectories
+from group_analysis import group_ana
+from dist_analysis import dist_ana
+from main import plot_all_tra
+from synthetic_data import write_dlc_csv
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def make_cohort(n_frames, seed=0):
+    """
+    write simulated csv files for all sessions of make_df into ./data/TwoOdor of the current directory
+    """
+    os.makedirs('./data/TwoOdor')
+    os.makedirs('./figures')
+    df = make_df(locate_ports=False)
+    for i_video, csv_name in enumerate(df['csv_path']):
+        if csv_name is not None:
+            write_dlc_csv(os.path.join('./data/TwoOdor', csv_name), n_frames=n_frames, seed=seed + i_video)
+
+
+def run_stages(repeat=1):
+    """
+    time each stage of the pipeline on the cohort in the current directory
+    :param repeat: number of runs, the fastest run of each stage is reported
+    :return: dict of {stage: seconds}
+    """
+    timing = {}
+    for i_repeat in range(repeat):
+        # start from csv files every time, so make_df includes parsing them,
+        # and clear the caches of statistics and figures, so every figure is rendered
+        for cache_dir in ['./data/session_cache', './data/group_stats', './data/figure_hashes']:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        timing_list = []
+        with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+            t = time.perf_counter()
+            df = make_df()
+            timing_list.append(('make_df', time.perf_counter() - t))
+            for stage, func in [('extract_trajectories', extract_trajectories),
+                                ('plot_all_tra', plot_all_tra),
+                                ('group_ana', group_ana),
+                                ('dist_ana', dist_ana)]:
+                t = time.perf_counter()
+                func(df)
+                timing_list.append((stage, time.perf_counter() - t))
+        for stage, seconds in timing_list:
+            timing[stage] = min(timing.get(stage, np.inf), seconds)
+    return timing
+
+
+def compare(results, baseline):
+    """
+    print the ratio of the timing of each stage to a baseline result file
+    """
+    base_timing = {(r['n_frames'], r['stage']): r['seconds'] for r in baseline['results']}
+    print(f"{'n_frames':>10} {'stage':>22} {'seconds':>10} {'baseline':>10} {'ratio':>8}")
+    for r in results['results']:
+        key = (r['n_frames'], r['stage'])
+        if key in base_timing:
+            print(f"{r['n_frames']:>10} {r['stage']:>22} {r['seconds']:>10.3f} "
+                  f"{base_timing[key]:>10.3f} {r['seconds'] / base_timing[key]:>8.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='time each stage of the pipeline on simulated data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000],
+                        help='number of frames per session')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of runs for each size, the fastest run of each stage is reported')
+    parser.add_argument('--output', default=None,
+                        help='path of the result file, ./benchmarks/<commit>.json by default')
+    parser.add_argument('--compare', default=None,
+                        help='path of a previous result file to compare with')
+    args = parser.parse_args()
+
+    commit = get_commit()
+    output = args.output or os.path.join('./benchmarks', commit + '.json')
+    output = os.path.abspath(output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    results = {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'results': [],
+    }
+    cwd = os.getcwd()
+    for n_frames in args.sizes:
+        work_dir = tempfile.mkdtemp()
+        try:
+            os.chdir(work_dir)
+            make_cohort(n_frames)
+            timing = run_stages(args.repeat)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir)
+        for stage, seconds in timing.items():
+            results['results'].append({'n_frames': n_frames, 'stage': stage, 'seconds': seconds})
+            print(f'{n_frames} frames, {stage}: {seconds:.3f} s')
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print('results saved to', output)
+
+    if baseline is not None:
+        with open(baseline) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,174 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from make_dataframe import make_df
+from group_analysis import interpolate_tra_batch
+from tra_store import load_trajectories, select_trajectories, get_side_names
+
+clusters_path = './data/trajectory_clusters.csv'
+
+
+def pairwise_distances(tra_interpld, block_size=1024, out_path=None):
+    """
+    distance between every pair of interpolated trajectories, the mean distance between their points at the same
+    phase as in get_tra_metrics, the matrix is filled in blocks of block_size x block_size pairs to bound the memory,
+    and only the blocks above the diagonal are computed since it is symmetric
+    :param tra_interpld: array of size (number of trajectories, num_p, 2), see group_analysis.interpolate_tra_batch
+    :param block_size: number of trajectories in a block
+    :param out_path: path of a .npy file to write the matrix to memory-mapped, it is kept in memory if None
+    :return: float32 array of size (number of trajectories, number of trajectories), in the unit of positions
+    """
+    n_tra, num_p = tra_interpld.shape[:2]
+    # computed in float32 like the matrix, which halves the memory traffic of the blocks
+    tra_interpld = np.asarray(tra_interpld, dtype=np.float32)
+    if out_path is None:
+        dist = np.empty((n_tra, n_tra), dtype=np.float32)
+    else:
+        dist = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=(n_tra, n_tra))
+
+    for start1 in range(0, n_tra, block_size):
+        block1 = tra_interpld[start1:start1 + block_size]
+        for start2 in range(start1, n_tra, block_size):
+            block2 = tra_interpld[start2:start2 + block_size]
+            # phases are summed one at a time, so a block only takes a few arrays of block_size x block_size
+            block = np.zeros((len(block1), len(block2)), dtype=np.float32)
+            for i_p in range(num_p):
+                dx = block1[:, None, i_p, 0] - block2[None, :, i_p, 0]
+                dy = block1[:, None, i_p, 1] - block2[None, :, i_p, 1]
+                block += np.sqrt(dx ** 2 + dy ** 2)
+            block /= num_p
+            dist[start1:start1 + len(block1), start2:start2 + len(block2)] = block
+            dist[start2:start2 + len(block2), start1:start1 + len(block1)] = block.T
+
+    if out_path is not None:
+        dist.flush()
+    return dist
+
+
+def kmedoids(dist, n_clusters, max_iter=100, seed=0, block_size=1024):
+    """
+    k-medoids clustering of a precomputed distance matrix, initialized by k-medoids++ and refined by alternating
+    the assignment of every trajectory to the nearest medoid and the choice of the medoid of every cluster,
+    rows of the matrix are read block_size at a time, so it can be memory-mapped
+    :param dist: array of size (n, n), symmetric distance matrix, see pairwise_distances
+    :param n_clusters: number of clusters
+    :param max_iter: maximum number of iterations
+    :param seed: seed of the random number generator of the initialization
+    :param block_size: number of rows read at a time
+    :return: labels: array of size (n), cluster of each trajectory, medoids: index of the medoid of each cluster
+    """
+    n_tra = len(dist)
+    n_clusters = min(n_clusters, n_tra)
+    if n_clusters == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    rng = np.random.default_rng(seed)
+
+    # k-medoids++, trajectories far from the medoids chosen so far are more likely to be the next medoid
+    medoids = [int(rng.integers(n_tra))]
+    nearest = np.asarray(dist[medoids[0]], dtype=np.float64)
+    for i_cluster in range(1, n_clusters):
+        weight = nearest ** 2
+        if weight.sum() > 0:
+            medoids.append(int(rng.choice(n_tra, p=weight / weight.sum())))
+        else:
+            medoids.append(int(rng.choice(np.setdiff1d(np.arange(n_tra), medoids))))
+        nearest = np.minimum(nearest, dist[medoids[-1]])
+
+    for i_iter in range(max_iter):
+        # the matrix is symmetric, so the rows of the medoids are read instead of their columns
+        labels = np.asarray(dist[medoids]).argmin(axis=0)
+        new_medoids = []
+        for i_cluster, medoid in enumerate(medoids):
+            members = np.flatnonzero(labels == i_cluster)
+            if len(members) == 0:
+                new_medoids.append(medoid)
+                continue
+            # total distance from each member to the other members of the cluster
+            total = np.zeros(len(members))
+            for start in range(0, len(members), block_size):
+                total += np.asarray(dist[members[start:start + block_size]])[:, members].sum(axis=0, dtype=np.float64)
+            new_medoids.append(int(members[total.argmin()]))
+        if new_medoids == medoids:
+            break
+        medoids = new_medoids
+    labels = np.asarray(dist[medoids]).argmin(axis=0)
+    return labels, np.array(medoids)
+
+
+def load_cohort_trajectories(df, num_p=11):
+    """
+    load and interpolate the trajectories of all sessions
+    :param df: DataFrame of sessions made by make_df
+    :param num_p: number of points to interpolate the trajectories
+    :return: trials: DataFrame with one row per trajectory to the left or right port, with columns mouse_name,
+             genotype, session, exp_name, trial and side, tra_interpld: array of size (number of trajectories, num_p, 2)
+    """
+    trials_list = []
+    tra_interpld_list = []
+    for i_video in range(len(df)):
+        tra_dict_path = df.loc[i_video, 'tra_dict_path']
+        if tra_dict_path is not None:
+            points, offsets, side = load_trajectories(tra_dict_path)
+            # trajectories to other ports than the left and right ones are left out
+            trial = np.flatnonzero(side >= 0)
+            points, offsets = select_trajectories(points, offsets, trial)
+            trials = pd.DataFrame({'trial': trial, 'side': get_side_names(side[trial])})
+            for i_key, key in enumerate(['mouse_name', 'genotype', 'session', 'exp_name']):
+                trials.insert(i_key, key, df.loc[i_video, key])
+            trials_list.append(trials)
+            tra_interpld_list.append(interpolate_tra_batch(points, offsets, num_p))
+    return pd.concat(trials_list, ignore_index=True), np.concatenate(tra_interpld_list)
+
+
+def cluster_trajectories(df, n_clusters=4, keys=('side',), num_p=11, out_dir=None, block_size=1024, seed=0):
+    """
+    cluster the trajectories of the cohort by the paths they take, separately in each group of trajectories
+    :param df: DataFrame of sessions made by make_df
+    :param n_clusters: number of clusters in each group
+    :param keys: columns that define the groups, such as ('side',) to cluster across the cohort,
+                 or ('exp_name', 'side') to cluster within each session
+    :param num_p: number of points to interpolate the trajectories
+    :param out_dir: directory to write the distance matrix of each group to memory-mapped, see pairwise_distances,
+                    the matrices are kept in memory if None
+    :param block_size: number of trajectories in a block of the distance matrix
+    :param seed: seed of the random number generator of the clustering
+    :return: DataFrame with one row per trajectory, the columns of load_cohort_trajectories, and
+             cluster: index of the cluster in the group, medoid: whether the trajectory is the medoid of its cluster
+    """
+    trials, tra_interpld = load_cohort_trajectories(df, num_p)
+    trials['cluster'] = -1
+    trials['medoid'] = False
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+
+    for group, idx in trials.groupby(list(keys), sort=False).indices.items():
+        out_path = None
+        if out_dir is not None:
+            group_name = '_'.join(str(value) for value in np.atleast_1d(group))
+            out_path = os.path.join(out_dir, group_name + '_distances.npy')
+        dist = pairwise_distances(tra_interpld[idx], block_size, out_path)
+        labels, medoids = kmedoids(dist, n_clusters, seed=seed, block_size=block_size)
+        trials.loc[idx, 'cluster'] = labels
+        trials.loc[idx[medoids], 'medoid'] = True
+    return trials
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='cluster the trajectories of all sessions by the paths they take')
+    parser.add_argument('--n-clusters', type=int, default=4, help='number of clusters of each side')
+    parser.add_argument('--within-session', action='store_true',
+                        help='cluster the trajectories of each session separately, instead of across the cohort')
+    parser.add_argument('--memmap-dir', default=None,
+                        help='directory to write the distance matrices to memory-mapped, for large cohorts')
+    parser.add_argument('--block-size', type=int, default=1024,
+                        help='number of trajectories in a block of the distance matrix')
+    args = parser.parse_args()
+
+    df = make_df(locate_ports=False)
+    keys = ('exp_name', 'side') if args.within_session else ('side',)
+    trials = cluster_trajectories(df, args.n_clusters, keys, out_dir=args.memmap_dir, block_size=args.block_size)
+    trials.to_csv(clusters_path, index=False)
+    print(trials.groupby(list(keys) + ['cluster']).size())
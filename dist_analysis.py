@@ -1,50 +1,51 @@
-import os
-import json
 import numpy as np
-from group_analysis import interpolate_tra, pixel_per_m
-import matplotlib.pyplot as plt
+from group_analysis import load_tra_metrics, has_side_ports
+from matplotlib.figure import Figure
 
-from plots import adjust_figure
+from plots import adjust_figure, get_fig_path
+from figures import figure_job, render_figures
 
 
-def dist_ana(df):
+def plot_session_dist(exp_name, tra_metrics):
+    """
+    plot the distance between the trajectories of a single session and the averaged trajectory
+    :param exp_name: name of the session
+    :param tra_metrics: DataFrame of the measures of every trajectory, see group_analysis.get_tra_metrics
+    """
+    left_tra_dis = tra_metrics.loc[tra_metrics['side'] == 'left', 'deviation'].to_numpy()
+    right_tra_dis = tra_metrics.loc[tra_metrics['side'] == 'right', 'deviation'].to_numpy()
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.scatter(np.arange(len(left_tra_dis)), left_tra_dis, label='left tra.')
+    ax.scatter(np.arange(len(right_tra_dis)), right_tra_dis, label='right tra.')
+    ax.set_ylabel("Distance from avg. tra. (mm)")
+    ax.set_xlabel("Trial number")
+    ax.legend()
+    ax.set_title("Distance from averaged trajectory \n"
+                 + exp_name)
+    ax.set_ylim([0, 5])
+    adjust_figure(ax)
+    fig.savefig(get_fig_path(exp_name + '_dist'), transparent=True, bbox_inches="tight")
+
+
+def get_dist_fig_job(exp_name, tra_metrics):
+    """
+    get the job to render the figure of plot_session_dist, see figures.render_figures
+    only the columns plotted are passed, so the figure is not rendered again when other measures change
+    """
+    return figure_job(get_fig_path(exp_name + '_dist'), plot_session_dist,
+                      exp_name, tra_metrics.loc[:, ['side', 'deviation']])
+
+
+def dist_ana(df, n_workers=1):
     """
     analyze the distance between the trajectories and the optimal trajectories
+    the measures of trajectories are calculated by group_analysis.group_ana
+    :param n_workers: number of worker processes to render figures
     """
-    for i_video in range(len(df)):
-        # extract trajectories from files
-        json_path = df.loc[i_video, 'tra_dict_path']
-        if json_path is not None:
-            exp_name = df.loc[i_video, 'exp_name']
-            f = open(json_path)
-            tra_dict = json.load(f)
-            left_tra = [np.array(tra) for tra in tra_dict['left_tra']]
-            right_tra = [np.array(tra) for tra in tra_dict['right_tra']]
-
-            # interpolate trajectories and calculate distance to averaged trajectory
-            num_p = 11
-            left_tra_interpld = np.array([interpolate_tra(tra, num_p) for tra in left_tra])
-            left_diff2avg_square = (left_tra_interpld - left_tra_interpld.mean(axis=0)) ** 2
-            left_dist2avg = np.sqrt(left_diff2avg_square[:, :, 0] + left_diff2avg_square[:, :, 1])
-
-            right_tra_interpld = np.array([interpolate_tra(tra, num_p) for tra in right_tra])
-            right_diff2avg_square = (right_tra_interpld - right_tra_interpld.mean(axis=0)) ** 2
-            right_dist2avg = np.sqrt(right_diff2avg_square[:, :, 0] + right_diff2avg_square[:, :, 1])
-
-            left_dist2avg = (left_dist2avg / pixel_per_m) * 1000  # convert to mm
-            right_dist2avg = (right_dist2avg / pixel_per_m) * 1000  # convert to mm
-            left_tra_dis = left_dist2avg.mean(axis=1)
-            right_tra_dis = right_dist2avg.mean(axis=1)
-
-            plt.figure()
-            plt.scatter(np.arange(len(left_tra_dis)), left_tra_dis, label='left tra.')
-            plt.scatter(np.arange(len(right_tra_dis)), right_tra_dis, label='right tra.')
-            plt.ylabel("Distance from avg. tra. (mm)")
-            plt.xlabel("Trial number")
-            plt.legend()
-            plt.title("Distance from averaged trajectory \n"
-                      + exp_name)
-            plt.ylim([0, 5])
-            adjust_figure()
-            plt.savefig(os.path.join('./figures/', exp_name + '_dist.pdf'), transparent=True, bbox_inches="tight")
-            plt.close()
+    jobs = []
+    # load measures of trajectories from files, they are only calculated for sessions with the three ports
+    for i_video in np.flatnonzero(has_side_ports(df)):
+        jobs.append(get_dist_fig_job(df.loc[i_video, 'exp_name'], load_tra_metrics(df.loc[i_video, 'tra_dict_path'])))
+    render_figures(jobs, n_workers)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.csv
+except ImportError:  # parse with the C engine of pandas
+    pyarrow = None
+
+
+def read_dlc_header(filename):
+    """
+    read the header of a DLC csv file, the rows of scorer, bodyparts and coords
+    :return: list of (bodypart, coord) of the columns after the index column
+    """
+    with open(filename) as f:
+        f.readline()  # scorer
+        bodyparts = f.readline().strip().split(',')[1:]
+        coords = f.readline().strip().split(',')[1:]
+    return list(zip(bodyparts, coords))
+
+
+def get_use_columns(filename, bodyparts=None):
+    """
+    get the columns of the given body parts in a DLC csv file
+    :return: columns: list of (bodypart, coord) to read, usecols: their positions in the csv file,
+             n_columns: number of columns in the csv file
+    """
+    all_columns = read_dlc_header(filename)
+    missing = set(bodyparts or []) - set(bodypart for bodypart, coord in all_columns)
+    if missing:
+        raise KeyError(f'body parts {sorted(missing)} are not tracked in {filename}')
+
+    # the first column is the frame index
+    use_idx = [i for i, (bodypart, coord) in enumerate(all_columns) if bodyparts is None or bodypart in bodyparts]
+    return [all_columns[i] for i in use_idx], [i + 1 for i in use_idx], len(all_columns) + 1
+
+
+def read_dlc_csv(filename, bodyparts=None):
+    """
+    read the columns of the given body parts from a DLC csv file, as float32 arrays
+    the csv file is parsed by pyarrow if it is installed, otherwise by pandas
+    :param filename: path of the DLC csv file
+    :param bodyparts: list of body parts to read, all body parts if None
+    :return: dict of {(bodypart, coord): array}, coord is x, y or likelihood
+    """
+    columns, usecols, n_columns = get_use_columns(filename, bodyparts)
+    if pyarrow is None:
+        data = pd.read_csv(filename, header=None, skiprows=3, usecols=usecols,
+                           dtype={i: np.float32 for i in usecols})
+        return {column: data[i].to_numpy() for column, i in zip(columns, usecols)}
+
+    # columns are named by position since the header is skipped
+    names = [str(i) for i in range(n_columns)]
+    table = pyarrow.csv.read_csv(
+        filename,
+        read_options=pyarrow.csv.ReadOptions(skip_rows=3, column_names=names),
+        convert_options=pyarrow.csv.ConvertOptions(include_columns=[names[i] for i in usecols],
+                                                   column_types={names[i]: pyarrow.float32() for i in usecols}))
+    return {column: table.column(names[i]).to_numpy() for column, i in zip(columns, usecols)}
+
+
+def iter_dlc_csv(filename, bodyparts=None, chunk_size=100000):
+    """
+    read the columns of the given body parts from a DLC csv file in chunks of frames, see read_dlc_csv
+    :return: iterator of dicts of {(bodypart, coord): array}
+    """
+    columns, usecols, n_columns = get_use_columns(filename, bodyparts)
+    for data in pd.read_csv(filename, header=None, skiprows=3, usecols=usecols,
+                            dtype={i: np.float32 for i in usecols}, chunksize=chunk_size):
+        yield {column: data[i].to_numpy() for column, i in zip(columns, usecols)}
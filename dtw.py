@@ -0,0 +1,116 @@
+import numpy as np
+
+band = 0.1  # Sakoe-Chiba band, in proportion of the length of the sequences
+num_ref = 50  # number of points of the mean path of a session that trajectories are warped to
+
+
+def get_dtw_cost(seqs1, lengths1, seqs2, lengths2, window=band):
+    """
+    dynamic time warping of pairs of sequences padded to the same length, the cumulative cost matrices of all pairs
+    are filled one anti-diagonal at a time, each anti-diagonal in a single vectorized step
+    :param seqs1: array of size (pairs, max length, 2), points of the first sequence of each pair
+    :param lengths1: array of size (pairs), length of the first sequences, at least 1
+    :param seqs2: array of size (pairs, max length, 2), points of the second sequence of each pair
+    :param lengths2: array of size (pairs), length of the second sequences, at least 1
+    :param window: Sakoe-Chiba band, point i of the first sequence can only be matched to point j of the second one
+                   if i / length1 and j / length2 are within window of each other, widened when needed so that
+                   there is always a warping path
+    :return: cost: sum of the distances between matched points along the optimal warping path of each pair,
+             n_steps: number of matched points along the path
+    """
+    n = np.asarray(lengths1)
+    m = np.asarray(lengths2)
+    n_pairs, max_n = seqs1.shape[:2]
+    max_m = seqs2.shape[1]
+    rows = np.arange(n_pairs)[:, None]
+    # cells (i, j) within the band satisfy |i (m - 1) - j (n - 1)| <= radius
+    radius = np.maximum(window * (n - 1) * (m - 1), np.maximum(n - 1, m - 1))
+    slope = np.maximum(n + m - 2, 1)
+
+    # cumulative cost and number of steps of the two previous anti-diagonals, indexed by i + 1,
+    # the first column stands for i = -1 and is always out of the matrix
+    cost_prev2 = np.full((n_pairs, max_n + 1), np.inf)
+    cost_prev1 = np.full((n_pairs, max_n + 1), np.inf)
+    steps_prev2 = np.zeros((n_pairs, max_n + 1), dtype=np.int64)
+    steps_prev1 = np.zeros((n_pairs, max_n + 1), dtype=np.int64)
+    cost = np.full(n_pairs, np.nan)
+    n_steps = np.zeros(n_pairs, dtype=np.int64)
+    for k in range(max_n + max_m - 1):
+        # cells (i, k - i) of the anti-diagonal within the band of each pair
+        lo = np.maximum(np.ceil((k * (n - 1) - radius) / slope), np.maximum(k - (m - 1), 0)).astype(np.int64)
+        hi = np.minimum(np.floor((k * (n - 1) + radius) / slope), np.minimum(n - 1, k)).astype(np.int64)
+        i = np.arange(max(lo.min(), 0), min(hi.max(), max_n - 1) + 1)
+        j = np.clip(k - i, 0, max_m - 1)
+        valid = (i >= lo[:, None]) & (i <= hi[:, None])
+
+        diff = seqs1[:, i] - seqs2[rows, j]
+        local = np.sqrt(diff[..., 0] ** 2 + diff[..., 1] ** 2)
+        if k == 0:
+            acc_cost = local
+            acc_steps = np.ones(local.shape, dtype=np.int64)
+        else:
+            # from (i - 1, j), (i, j - 1) and (i - 1, j - 1)
+            candidates = np.stack((cost_prev1[:, i], cost_prev1[:, i + 1], cost_prev2[:, i]))
+            candidate_steps = np.stack((steps_prev1[:, i], steps_prev1[:, i + 1], steps_prev2[:, i]))
+            best = candidates.argmin(axis=0)[None]
+            acc_cost = local + np.take_along_axis(candidates, best, axis=0)[0]
+            acc_steps = np.take_along_axis(candidate_steps, best, axis=0)[0] + 1
+
+        cost_cur = np.full((n_pairs, max_n + 1), np.inf)
+        steps_cur = np.zeros((n_pairs, max_n + 1), dtype=np.int64)
+        cost_cur[:, i + 1] = np.where(valid, acc_cost, np.inf)
+        steps_cur[:, i + 1] = acc_steps
+
+        # the last cell of a pair is on anti-diagonal n + m - 2
+        done = np.flatnonzero(n + m - 2 == k)
+        cost[done] = cost_cur[done, n[done]]
+        n_steps[done] = steps_cur[done, n[done]]
+
+        cost_prev2, cost_prev1 = cost_prev1, cost_cur
+        steps_prev2, steps_prev1 = steps_prev1, steps_cur
+    return cost, n_steps
+
+
+def pad_sequences(seqs):
+    """
+    pad a list of sequences of points to the same length
+    :return: array of size (number of sequences, max length, 2), array of lengths
+    """
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    padded = np.zeros((len(seqs), max(lengths.max(initial=0), 1), 2))
+    for i_seq, seq in enumerate(seqs):
+        padded[i_seq, :len(seq)] = np.asarray(seq)[:, :2]
+    return padded, lengths
+
+
+def dtw_batch(seqs1, seqs2, window=band, chunk_size=256):
+    """
+    dynamic time warping distance of pairs of trajectories, pairs of similar lengths are warped together
+    in chunks of chunk_size pairs, see get_dtw_cost
+    :param seqs1: list of trajectories, the first two cols of each one are x and y positions
+    :param seqs2: list of trajectories, warped to the trajectories of seqs1 one to one
+    :param window: Sakoe-Chiba band, in proportion of the length of the trajectories
+    :param chunk_size: number of pairs warped at a time
+    :return: array of the mean distance between matched points along the optimal warping path,
+             in the unit of positions, NaN for pairs with an empty trajectory
+    """
+    lengths1 = np.array([len(seq) for seq in seqs1], dtype=np.int64)
+    lengths2 = np.array([len(seq) for seq in seqs2], dtype=np.int64)
+    distance = np.full(len(seqs1), np.nan)
+    pair_idx = np.flatnonzero((lengths1 > 0) & (lengths2 > 0))
+    # pairs of similar lengths share the anti-diagonals of a chunk
+    pair_idx = pair_idx[np.lexsort((lengths2[pair_idx], lengths1[pair_idx]))]
+    for start in range(0, len(pair_idx), chunk_size):
+        chunk = pair_idx[start:start + chunk_size]
+        padded1, chunk_lengths1 = pad_sequences([seqs1[i] for i in chunk])
+        padded2, chunk_lengths2 = pad_sequences([seqs2[i] for i in chunk])
+        cost, n_steps = get_dtw_cost(padded1, chunk_lengths1, padded2, chunk_lengths2, window)
+        distance[chunk] = cost / n_steps
+    return distance
+
+
+def dtw_distance(seq1, seq2, window=band):
+    """
+    dynamic time warping distance of two trajectories, see dtw_batch
+    """
+    return dtw_batch([seq1], [seq2], window)[0]
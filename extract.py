@@ -1,17 +1,207 @@
 import os
 import numpy as np
-import pandas as pd
-import json
+
+from session_cache import iter_session_chunks
+from tra_store import save_trajectories
+from ports import get_port_index, nearest_port
+from instrument import count
+
+threshold = 5  # pixels, cutoff distance for port entry
+port_radius = {}  # pixels, cutoff distance of the ports that differ from threshold, such as {'port5': 8}
+origin_ports = ['centerport']  # ports where a long enough stay starts a trial
+max_tra_len = 4  # in seconds
+fps = 84
+tracked_bodyparts = []  # body parts recorded along the nose in every trajectory, such as ['head', 'body']
 
 
 def distance(x1, y1, x2, y2):
     return np.sqrt((x1 - x2)**2 + (y1 - y2)**2)
 
 
+def get_side(ports, destination):
+    """
+    get the side of trials from the port where they ended
+    :return: array, 0 for trials to the left port, 1 for trials to the right port, -1 for the other ports
+    """
+    side_idx = get_port_index(ports, ['leftport', 'rightport'])
+    destination = np.asarray(destination)
+    return np.where(destination == side_idx[0], 0, np.where(destination == side_idx[1], 1, -1))
+
+
+def get_origins(ports, origins=None):
+    """
+    get whether a stay in each port starts a trial
+    :param origins: list of names of the ports where trials start, origin_ports if None,
+                    trials start in every port if none of them are in the arena
+    :return: boolean array of size (number of ports)
+    """
+    origins = origin_ports if origins is None else origins
+    is_origin = np.isin(ports['names'], origins)
+    if not is_origin.any():
+        print(f'warning: none of the ports {list(origins)} are in the arena, trials start in every port')
+        return np.ones(len(ports['names']), dtype=bool)
+    return is_origin
+
+
+def new_scan_state():
+    """
+    state of trial segmentation carried over from one chunk of frames to the next, see get_trial_windows
+    frame: index of the next frame to scan
+    dwell_port: port the nose is in at the last scanned frame, -1 if not in any port
+    dwell_count: number of consecutive frames in dwell_port up to the last scanned frame
+    tra_start: first frame of the unfinished trial, None if not recording
+    tra_origin: port where the unfinished trial started
+    """
+    return {'frame': 0, 'dwell_port': -1, 'dwell_count': 0, 'tra_start': None, 'tra_origin': -1}
+
+
+def get_trial_windows(port_idx, is_origin, min_dwell_frames=5, state=None):
+    """
+    segment trials from the port the nose is in at each frame
+    a trial starts at the first frame out of an origin port after the nose stayed in the port
+    for min_dwell_frames consecutive frames, and ends at the first frame that is in any port
+    :param port_idx: int array, index of the port the nose is in at each frame, -1 if not in any port,
+                     see ports.nearest_port
+    :param is_origin: boolean array of size (number of ports), whether a stay in each port starts a trial
+    :param min_dwell_frames: number of consecutive frames in an origin port needed to trigger recording
+    :param state: dict made by new_scan_state, to scan a session in consecutive chunks of frames,
+                  it is updated in place, trials are then returned in the chunk where they end
+    :return: starts, ends: first and last frame index (inclusive) of each trial,
+             origin, destination: index of the port where each trial started and ended
+    """
+    port_idx = np.asarray(port_idx, dtype=int)
+    is_origin = np.asarray(is_origin, dtype=bool)
+    if state is None:
+        state = new_scan_state()
+    n_frames = len(port_idx)
+    first_frame = state['frame']
+
+    # run length encoding of the frames in the same port
+    padded = np.concatenate(([-1], port_idx, [-1]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    run_starts, run_ends = edges[:-1], edges[1:]  # run_ends is exclusive
+    run_ports = padded[run_starts + 1]
+    in_port = run_ports >= 0
+    run_starts, run_ends, run_ports = run_starts[in_port], run_ends[in_port], run_ports[in_port]
+    run_lengths = run_ends - run_starts
+    if len(run_starts) > 0 and run_starts[0] == 0 and run_ports[0] == state['dwell_port']:
+        # the run continues the stay at the end of the previous chunk
+        run_lengths[0] += state['dwell_count']
+
+    # recording is triggered by a long enough stay in an origin port, and starts once the nose left the port
+    trigger = (run_lengths >= min_dwell_frames) & is_origin[run_ports] & (run_ends < n_frames)
+    starts = run_ends[trigger]
+    origin = run_ports[trigger]
+    if state['dwell_count'] >= min_dwell_frames and is_origin[state['dwell_port']] \
+            and n_frames > 0 and port_idx[0] != state['dwell_port']:
+        starts = np.concatenate(([0], starts))
+        origin = np.concatenate(([state['dwell_port']], origin))
+    starts = starts + first_frame
+    if state['tra_start'] is not None:
+        starts = np.concatenate(([state['tra_start']], starts))
+        origin = np.concatenate(([state['tra_origin']], origin))
+
+    # trial ends at the first frame in any of the ports
+    stop_idx = np.flatnonzero(port_idx >= 0) + first_frame
+    i_stop = np.searchsorted(stop_idx, starts)
+    complete = i_stop < len(stop_idx)
+    unfinished_starts, unfinished_origin = starts[~complete], origin[~complete]
+    starts, origin = starts[complete], origin[complete]
+    ends = stop_idx[i_stop[complete]]
+    destination = port_idx[ends - first_frame]
+
+    # carry the state over to the next chunk
+    if n_frames > 0:
+        state['dwell_port'] = int(port_idx[-1])
+        state['dwell_count'] = int(run_lengths[-1]) if port_idx[-1] >= 0 else 0
+    if len(unfinished_starts) > 0:
+        state['tra_start'], state['tra_origin'] = int(unfinished_starts[0]), int(unfinished_origin[0])
+    else:
+        state['tra_start'], state['tra_origin'] = None, -1
+    state['frame'] = first_frame + n_frames
+    return starts, ends, origin, destination
+
+
+def extract_session(csv_name, ports, tra_dict_path, chunk_size=None, bodyparts=None, origins=None):
+    """
+    extract trajectories of a single session and save them in a ragged array, see tra_store.save_trajectories
+    trials are segmented by the nose, other body parts are recorded over the same frames
+    :param csv_name: name of the DLC csv file in ./data/TwoOdor
+    :param ports: dict, port model of the arena made by ports.make_ports
+    :param tra_dict_path: path to save the trajectories
+    :param chunk_size: number of frames to scan at a time, to bound the memory used by long recordings,
+                       the whole session is loaded at once if None
+    :param bodyparts: list of other body parts to record with their x, y and likelihood, tracked_bodyparts if None
+    :param origins: list of names of the ports where trials start, see get_origins
+    :return: number of trajectories
+    """
+    filename = os.path.join('./data/TwoOdor', csv_name)
+    bodyparts = tracked_bodyparts if bodyparts is None else bodyparts
+    columns = [('nose', 'x'), ('nose', 'y')] \
+        + [(bodypart, coord) for bodypart in bodyparts for coord in ('x', 'y', 'likelihood')]
+    is_origin = get_origins(ports, origins)
+
+    state = new_scan_state()
+    # positions from the start of the unfinished trial to the last scanned frame, one row per column
+    tail = np.empty((len(columns), 0), dtype=np.float32)
+    points_list = []
+    parts_list = []
+    lengths_list = []
+    origin_list = []
+    destination_list = []
+    for chunk in iter_session_chunks(filename, columns, chunk_size):
+        nose_x, nose_y = chunk[:2]
+        first_frame = state['frame']
+        count('frames_scanned', len(nose_x))
+        port_idx = nearest_port(nose_x, nose_y, ports)
+
+        # need to in an origin port consecutively 5 frames to trigger recording
+        starts, ends, origin, destination = get_trial_windows(port_idx, is_origin, min_dwell_frames=5, state=state)
+        # drop trials back to the origin port and trials that are too long
+        keep = (destination != origin) & (ends - starts + 1 <= max_tra_len * fps)
+        starts, ends, origin, destination = starts[keep], ends[keep], origin[keep], destination[keep]
+
+        # record positions of all columns, and frame index of the trajectories in a ragged array
+        chunk = np.concatenate((tail, np.stack(chunk)), axis=1)
+        base_frame = first_frame - tail.shape[1]
+        lengths = ends - starts + 1
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        frames = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        values = chunk[:, frames - base_frame]
+        points_list.append(np.stack((values[0], values[1], frames), axis=1))
+        parts_list.append(values[2:])
+        lengths_list.append(lengths)
+        origin_list.append(origin)
+        destination_list.append(destination)
+
+        # keep the positions of the unfinished trial, unless it is already too long to be recorded
+        tra_start = state['tra_start']
+        if tra_start is not None and state['frame'] - tra_start <= max_tra_len * fps:
+            tail = chunk[:, tra_start - base_frame:].copy()
+        else:
+            tail = tail[:, :0]
+
+    lengths = np.concatenate(lengths_list)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    points = np.concatenate(points_list)
+    parts = np.concatenate(parts_list, axis=1)
+    origin = np.concatenate(origin_list)
+    destination = np.concatenate(destination_list)
+    side = get_side(ports, destination)
+
+    print(f'number of trajectories: {len(side)}')
+    count('trajectories', len(side))
+
+    # save trajectories
+    save_trajectories(tra_dict_path, points, offsets, side, dict(zip(columns[2:], parts)),
+                      origin, destination, ports['names'])
+    return len(side)
+
+
 def extract_trajectories(data_frame):
     """
     extract trajectories from the set of data specified in data_frame
-    and save them in a json file
+    and save them in a ragged array, see tra_store.save_trajectories
     """
     if not os.path.exists('./data/extracted_trajectories'):
         os.makedirs('./data/extracted_trajectories')
@@ -22,84 +212,6 @@ def extract_trajectories(data_frame):
         csv_name = data_frame.loc[i_video, 'csv_path']
 
         if csv_name is not None:
-            filename = os.path.join('./data/TwoOdor', csv_name)
-            data = pd.read_csv(filename, header=[1, 2], index_col=0)
-
-            centerport_x, centerport_y = data_frame.loc[i_video, 'center_port']
-            leftport_x, leftport_y = data_frame.loc[i_video, 'left_port']
-            rightport_x, rightport_y = data_frame.loc[i_video, 'right_port']
-
-            # extract trajectories
-            nose_x = data.loc[:, ('nose', 'x')]
-            nose_y = data.loc[:, ('nose', 'y')]
-
-            threshold = 5  # pixels, cutoff distance for port entry
-
-            in_center_count = 0
-            left_center = False
-            record = False
-            max_tra_len = 4 # in seconds
-            fps = 84
-            tra = []
-
-            tra_list = []
-            left_tra_list = []
-            right_tra_list = []
-            for i in range(len(nose_x)):
-                in_center = distance(nose_x[i], nose_y[i], centerport_x, centerport_y) < threshold
-                if in_center:
-                    # count to 5
-                    in_center_count += 1
-                else:
-                    in_center_count = 0
-
-                # need to in center consecutively 5 frames to trigger recording
-                if in_center_count >= 5:
-                    record = True
-
-                if record:
-                    if not in_center:
-                        left_center = True
-
-                    if left_center:
-                        # record nose positions, and frame index
-                        tra.append((nose_x[i], nose_y[i], i))
-
-                        in_left = distance(nose_x[i], nose_y[i], leftport_x, leftport_y) < threshold
-                        in_right = distance(nose_x[i], nose_y[i], rightport_x, rightport_y) < threshold
-
-                        assert (in_center and (in_left or in_right)) == False, 'not possible position'
-                        # if first left center and then in center again
-                        if in_center:
-                            record = False
-                            tra = []
-                            left_center = False
-                        elif in_left or in_right:
-                            record = False
-                            if len(tra) <= max_tra_len * fps:
-                                if in_left:
-                                    left_tra_list.append(tra)
-                                    tra_list.append(tra)
-                                elif in_right:
-                                    right_tra_list.append(tra)
-                                    tra_list.append(tra)
-                                else:
-                                    raise RuntimeError
-                            tra = []
-                            left_center = False
-                        else:
-                            pass
-
-            print(f'number of trajectories: {len(tra_list)}')
-
-            # save a list of trajectories
-            tra_dict = {
-                'left_tra': left_tra_list,
-                'right_tra': right_tra_list,
-                'all_tra': tra_list,
-            }
-
-            json_file = json.dumps(tra_dict)
-            f = open(data_frame.loc[i_video, 'tra_dict_path'], "w")  # open file for writing, "w"
-            f.write(json_file)  # write json object to file
-            f.close()  # close file
+            extract_session(csv_name,
+                            data_frame.loc[i_video, 'ports'],
+                            data_frame.loc[i_video, 'tra_dict_path'])
@@ -0,0 +1,137 @@
+import os
+import hashlib
+import inspect
+import importlib
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import matplotlib
+
+from manifest import get_hash
+from instrument import count
+
+hash_dir = './data/figure_hashes'
+style_modules = ['plots']  # modules of the plotting helpers and style shared by all figures
+
+
+def init_worker():
+    # render without a display
+    matplotlib.use('Agg')
+
+
+def figure_job(fig_path, func, *args, **kwargs):
+    """
+    describe a figure to render
+    :param fig_path: path of the figure file written by func
+    :param func: plotting function defined at module level, so it can run in a worker process,
+                 func(*args, **kwargs) writes the figure
+    :return: dict
+    """
+    return {'path': fig_path, 'func': func, 'args': args, 'kwargs': kwargs}
+
+
+def update_data_hash(sha, data):
+    """
+    add data to a hash by value, so equal data hash the same whether it was computed or loaded from files,
+    e.g. numpy and python floats, or a column of a DataFrame and an array
+    """
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        update_data_hash(sha, data.index.tolist())
+        if isinstance(data, pd.DataFrame):
+            update_data_hash(sha, data.columns.tolist())
+        update_data_hash(sha, data.to_numpy())
+    elif isinstance(data, np.ndarray):
+        sha.update(f'array{data.shape}'.encode())
+        if data.dtype.kind in 'biuf':
+            sha.update(np.ascontiguousarray(data, dtype=np.float64).tobytes())
+        else:
+            update_data_hash(sha, data.tolist())
+    elif isinstance(data, (list, tuple)):
+        sha.update(b'[')
+        for item in data:
+            update_data_hash(sha, item)
+        sha.update(b']')
+    elif isinstance(data, dict):
+        sha.update(b'{')
+        for key in sorted(data, key=str):
+            update_data_hash(sha, key)
+            update_data_hash(sha, data[key])
+        sha.update(b'}')
+    elif isinstance(data, (float, np.floating, int, np.integer)) and not isinstance(data, bool):
+        sha.update(repr(float(data)).encode())
+    else:
+        sha.update(repr(data).encode())
+    sha.update(b',')
+
+
+@functools.lru_cache(maxsize=None)
+def get_code_hash(module_name):
+    """
+    hash of the plotting code: the source of the module of a plotting function and of style_modules,
+    and the version of matplotlib, so figures are rendered again after the plotting code is edited
+    """
+    sources = [inspect.getsource(importlib.import_module(name)) for name in [module_name] + style_modules]
+    return get_hash(matplotlib.__version__, *sources)
+
+
+def get_job_hash(job):
+    """
+    hash of the plotting function, its code and all the data and parameters it is called with
+    """
+    sha = hashlib.sha1()
+    update_data_hash(sha, [job['args'], job['kwargs']])
+    return get_hash(job['func'].__module__, job['func'].__qualname__, get_code_hash(job['func'].__module__),
+                    sha.hexdigest())
+
+
+def get_hash_path(fig_path):
+    # one file per figure, so sessions rendered in different processes do not write the same file
+    return os.path.join(hash_dir, os.path.basename(fig_path) + '.hash')
+
+
+def is_rendered(job, job_hash):
+    """
+    check whether the figure of a job was rendered before from the same data and parameters
+    """
+    hash_path = get_hash_path(job['path'])
+    if not os.path.exists(job['path']) or not os.path.exists(hash_path):
+        return False
+    with open(hash_path) as f:
+        return f.read() == job_hash
+
+
+def render(job):
+    os.makedirs(os.path.dirname(job['path']) or '.', exist_ok=True)
+    job['func'](*job['args'], **job['kwargs'])
+    return job['path']
+
+
+def render_figures(jobs, n_workers=1, force=False):
+    """
+    render the figures of jobs made by figure_job, figures rendered before from the same data and parameters
+    are skipped, see get_job_hash
+    :param jobs: list of jobs
+    :param n_workers: number of worker processes, figures are rendered in the current process if it is 1
+    :param force: whether to render all figures, even if they did not change
+    :return: list of paths of the rendered figures
+    """
+    job_hashes = [get_job_hash(job) for job in jobs]
+    todo = [(job, job_hash) for job, job_hash in zip(jobs, job_hashes) if force or not is_rendered(job, job_hash)]
+
+    if n_workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker) as pool:
+            list(pool.map(render, [job for job, job_hash in todo]))
+    else:
+        for job, job_hash in todo:
+            render(job)
+
+    # hashes are written after rendering, so a figure that failed is rendered again in the next run
+    os.makedirs(hash_dir, exist_ok=True)
+    for job, job_hash in todo:
+        with open(get_hash_path(job['path']), 'w') as f:
+            f.write(job_hash)
+    count('figures', len(todo))
+    count('figures_skipped', len(jobs) - len(todo))
+    return [job['path'] for job, job_hash in todo]
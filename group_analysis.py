@@ -1,7 +1,14 @@
-import json
+import os
 import numpy as np
+import pandas as pd
 
-from plots import two_set_scatter_plot, error_plot
+from plots import two_set_scatter_plot, error_plot, get_fig_path
+from figures import figure_job, render_figures
+from tra_store import load_trajectories, split_trajectories, select_trajectories, get_side_names
+from dtw import dtw_batch
+import dtw
+from stats import load_group_stats
+from instrument import count
 
 pixel_per_m = 325 / 0.320
 fps = 84
@@ -23,6 +30,41 @@ def interpolate_tra(trajectory, num_points=10):
     return np.stack((x, y), axis=1)
 
 
+def get_interp_weights(lengths, num_points):
+    """
+    get the indices and weights to linearly interpolate trajectories of given lengths to num_points points
+    :param lengths: array of trajectory lengths
+    :param num_points: number of points to interpolate
+    :return: lo, hi: indices of the points on both sides, size (len(lengths), num_points)
+             weight: weight of the hi points, size (len(lengths), num_points)
+    """
+    pos = np.linspace(0.0, 1.0, num_points)[None, :] * (lengths[:, None] - 1)
+    lo = np.minimum(np.floor(pos).astype(np.int64), np.maximum(lengths[:, None] - 2, 0))
+    hi = np.minimum(lo + 1, lengths[:, None] - 1)
+    weight = pos - lo
+    return lo, hi, weight
+
+
+def interpolate_tra_batch(points, offsets, num_points=10):
+    """
+    interpolate a ragged array of trajectories to the same length by linear method, same as interpolate_tra
+    :param points: the first two cols of points are x and y positions in pixels
+    :param offsets: array of size (number of trajectories + 1), trajectory i is points[offsets[i]:offsets[i+1]]
+    :param num_points: number of points to interpolate
+    :return: interpolated trajectories, size (number of trajectories, num_points, 2)
+    """
+    offsets = np.asarray(offsets)
+    # trajectories with the same length share the interpolation indices and weights
+    lengths, inverse = np.unique(np.diff(offsets), return_inverse=True)
+    lo, hi, weight = get_interp_weights(lengths, num_points)
+
+    xy = np.asarray(points[:, :2])
+    lo = xy[offsets[:-1, None] + lo[inverse]]
+    hi = xy[offsets[:-1, None] + hi[inverse]]
+    weight = weight[inverse][:, :, None]
+    return lo + (hi - lo) * weight
+
+
 def get_tra_avg_speed(trajectory):
     """
     get the averaged velocity of a single trajectory
@@ -50,133 +92,323 @@ def get_tra_dis2line(trajectory, p1, p2):
     return mean_dis
 
 
-def group_ana(df):
+def get_tra_metrics(points, offsets, side, center_port, left_port, right_port, num_p=11,
+                    num_ref=None, window=None):
+    """
+    calculate the measures of every trajectory of a session in a single vectorized pass,
+    only the trajectories to the left and right ports are measured
+    :param points: the first two cols of points are x and y positions in pixels, see tra_store
+    :param offsets: array of size (number of trajectories + 1), trajectory i is points[offsets[i]:offsets[i+1]]
+    :param side: array of size (number of trajectories), 0 for left trajectories, 1 for right trajectories,
+                 -1 for trajectories to other ports, which are left out
+    :param center_port: tuple, coordinate of the center port
+    :param left_port: tuple, coordinate of the left port
+    :param right_port: tuple, coordinate of the right port
+    :param num_p: number of points to interpolate the trajectories
+    :param num_ref: number of points of the averaged path of each side, that trajectories are warped to,
+                    dtw.num_ref if None
+    :param window: Sakoe-Chiba band of the warping, see dtw.dtw_batch, dtw.band if None
+    :return: DataFrame with one row per trajectory, columns are
+             trial: index of the trajectory in the session, side: 'left' or 'right', num_frames,
+             dist2avg{i}: distance from the averaged trajectory at phase i, in mm,
+             deviation: averaged distance from the averaged trajectory, in mm,
+             dtw: dynamic time warping distance from the averaged path, in mm, it does not depend on the speed
+                  along the path,
+             dis2line: averaged distance from the line connecting the ports, in mm,
+             avg_speed: averaged velocity, in m/s, NaN for trajectories of a single frame
+    """
+    num_ref = dtw.num_ref if num_ref is None else num_ref
+    window = dtw.band if window is None else window
+    trial = np.flatnonzero(np.asarray(side) >= 0)
+    points, offsets = select_trajectories(points, offsets, trial)
+    side = np.asarray(side)[trial]
+    lengths = np.diff(offsets)
+    xy = np.asarray(points[:, :2], dtype=np.float64)
+    tra_idx = np.repeat(np.arange(len(lengths)), lengths)
+
+    # interpolate trajectories and calculate distance to averaged trajectory of the same side
+    tra_interpld = interpolate_tra_batch(xy, offsets, num_p)
+    avg_tra = np.zeros((2, num_p, 2))
+    for s in (0, 1):
+        if np.any(side == s):
+            avg_tra[s] = tra_interpld[side == s].mean(axis=0)
+    diff2avg_square = (tra_interpld - avg_tra[side]) ** 2
+    dist2avg = np.sqrt(diff2avg_square[:, :, 0] + diff2avg_square[:, :, 1])
+    dist2avg = (dist2avg / pixel_per_m) * 1000  # convert to mm
+
+    # warp every trajectory to the averaged path of the same side, sampled at num_ref points
+    ref_interpld = interpolate_tra_batch(xy, offsets, num_ref)
+    avg_path = np.zeros((2, num_ref, 2))
+    for s in (0, 1):
+        if np.any(side == s):
+            avg_path[s] = ref_interpld[side == s].mean(axis=0)
+    tra_dtw = dtw_batch(split_trajectories(xy, offsets), avg_path[side], window)
+    tra_dtw = (tra_dtw / pixel_per_m) * 1000
+
+    # calculate distance between trajectories and the straight line from the center port to the side port
+    x1, y1 = center_port
+    x2, y2 = np.array([left_port, right_port])[side[tra_idx]].T
+    distance = np.abs((x2 - x1) * (y1 - xy[:, 1]) -
+                      (x1 - xy[:, 0]) * (y2 - y1)) / np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+    dis2line = np.bincount(tra_idx, weights=distance, minlength=len(lengths)) / lengths
+    dis2line = (dis2line / pixel_per_m) * 1000
+
+    # calculate average velocity, steps across two trajectories are excluded
+    step = np.sqrt(np.sum(np.diff(xy, axis=0) ** 2, axis=1))
+    within = tra_idx[1:] == tra_idx[:-1]
+    step_sum = np.bincount(tra_idx[1:][within], weights=step[within], minlength=len(lengths))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_speed = (step_sum / (lengths - 1) * fps) / pixel_per_m
+
+    tra_metrics = pd.DataFrame({
+        'trial': trial,
+        'side': get_side_names(side),
+        'num_frames': lengths,
+    })
+    for i_p in range(num_p):
+        tra_metrics[f'dist2avg{i_p}'] = dist2avg[:, i_p]
+    tra_metrics['deviation'] = dist2avg.mean(axis=1)
+    tra_metrics['dtw'] = tra_dtw
+    tra_metrics['dis2line'] = dis2line
+    tra_metrics['avg_speed'] = avg_speed
+    return tra_metrics
+
+
+def get_tra_metrics_path(tra_dict_path):
+    return os.path.join(tra_dict_path, 'tra_metrics.csv')
+
+
+def load_tra_metrics(tra_dict_path):
+    return pd.read_csv(get_tra_metrics_path(tra_dict_path), float_precision='round_trip')
+
+
+def make_tra_metrics(tra_dict_path, center_port, left_port, right_port, num_p=11):
+    """
+    calculate the measures of every trajectory of a session, see get_tra_metrics,
+    and save them next to the extracted trajectories
+    """
+    points, offsets, side = load_trajectories(tra_dict_path)
+    tra_metrics = get_tra_metrics(points, offsets, side, center_port, left_port, right_port, num_p)
+    tra_metrics.to_csv(get_tra_metrics_path(tra_dict_path), index=False)
+    count('trajectories', len(tra_metrics))
+    return tra_metrics
+
+
+def summarize_trajectories(grouped, num_p=11):
+    """
+    summarize the measures of every trajectory into the measures of each group of trajectories, such as a session
+    :param grouped: DataFrameGroupBy of trajectories with the columns made by get_tra_metrics
+    :param num_p: number of points to interpolate the trajectories
+    :return: DataFrame with one row per group, columns are the measures
+    """
+    dist2avg_cols = [f'dist2avg{i_p}' for i_p in range(num_p)]
+    means = grouped[dist2avg_cols + ['deviation', 'dtw', 'dis2line', 'avg_speed']].mean()
+
+    measures = pd.DataFrame(index=means.index)
+    # calculate the distances to average trajectory of each trajectory, and take mean
+    measures['tra_deviation'] = means['deviation']
+    # dynamic time warping distance to the averaged path
+    measures['tra_dtw'] = means['dtw']
+    # calculate the center point dispersion
+    measures['dispersion_center'] = means[f'dist2avg{int(num_p/2)}']
+    # dispersion at different phase of the trajectory
+    for i_p in range(num_p):
+        measures[f'dispersion{i_p}'] = means[f'dist2avg{i_p}']
+    # distance between trajectories and a straight line
+    measures['avg_tra_dis2line'] = means['dis2line']
+    # average velocity, trajectories of a single frame have no speed and are left out
+    measures['avg_tra_vel'] = means['avg_speed']
+    # number of trajectories
+    measures['num_tra'] = grouped.size()
+    # number of trajectories of a single frame, which are not in avg_tra_vel
+    measures['num_single_frame_tra'] = measures['num_tra'] - grouped['avg_speed'].count()
+    return measures
+
+
+def summarize_tra_metrics(tra_metrics, num_p=11):
+    """
+    summarize the measures of every trajectory of a session into the measures of the session
+    :param tra_metrics: DataFrame made by get_tra_metrics
+    :param num_p: number of points to interpolate the trajectories
+    :return: dict of measures of the session
+    """
+    # a single group, which is kept when the session has no trajectory
+    session = pd.Categorical(np.zeros(len(tra_metrics), dtype=int), categories=[0])
+    return summarize_trajectories(tra_metrics.groupby(session, observed=False), num_p).iloc[0].to_dict()
+
+
+def has_side_ports(df):
+    """
+    get whether each session has tracking data and the center, left and right ports, the measures of trajectories
+    are only calculated for these sessions
+    :param df: DataFrame of sessions made by make_df, with the ports located
+    :return: boolean Series with the index of df
+    """
+    return df['tra_dict_path'].notna() & df['center_port'].notna() & df['left_port'].notna() \
+        & df['right_port'].notna()
+
+
+def make_cohort_table(df, tra_metrics_list=None):
+    """
+    make the table of all trajectories of the cohort, with one row per trajectory
+    :param df: DataFrame of sessions made by make_df
+    :param tra_metrics_list: list of DataFrames made by get_tra_metrics, one for each session of has_side_ports
+                             in the order of df, they are loaded from the files saved by make_tra_metrics if None
+    :return: DataFrame with the keys mouse_name, genotype, session, exp_name, trial and side as categorical columns,
+             followed by the measures of each trajectory, see get_tra_metrics
+    """
+    sessions = df[has_side_ports(df)]
+    if tra_metrics_list is None:
+        tra_metrics_list = [load_tra_metrics(tra_dict_path) for tra_dict_path in sessions['tra_dict_path']]
+    lengths = [len(tra_metrics) for tra_metrics in tra_metrics_list]
+
+    cohort = pd.concat(tra_metrics_list, ignore_index=True)
+    for i_key, key in enumerate(['mouse_name', 'genotype', 'session', 'exp_name']):
+        cohort.insert(i_key, key, pd.Categorical(np.repeat(sessions[key].to_numpy(), lengths),
+                                                 categories=sessions[key].unique()))
+    cohort['side'] = cohort['side'].astype('category')
+    return cohort
+
+
+def get_session_measures(cohort, df, num_p=11):
+    """
+    get the measures of every session from the table of all trajectories, in a single groupby
+    :param cohort: DataFrame made by make_cohort_table
+    :param df: DataFrame of sessions made by make_df
+    :param num_p: number of points to interpolate the trajectories
+    :return: DataFrame of the measures with the index of df, and the keys mouse_name, genotype and session,
+             measures are NaN for sessions without tracking data or without the center, left and right ports
+    """
+    # sessions without trajectories are kept as empty groups
+    measures = summarize_trajectories(cohort.groupby('exp_name', observed=False), num_p)
+    measures.index = measures.index.astype(str)
+    measures = measures.reindex(df['exp_name'])
+    measures.index = df.index
+    return pd.concat([df.loc[:, ['mouse_name', 'genotype', 'session']], measures], axis=1)
+
+
+def group_ana(df, n_workers=1):
     # calculate various measures for each trajectory
-    for i_video in range(len(df)):
-        # extract trajectories from files
-        json_path = df.loc[i_video, 'tra_dict_path']
-        if json_path is not None:
-            f = open(json_path)
-            tra_dict = json.load(f)
-            all_tra = [np.array(tra) for tra in tra_dict['all_tra']]
-            left_tra = [np.array(tra) for tra in tra_dict['left_tra']]
-            right_tra = [np.array(tra) for tra in tra_dict['right_tra']]
-
-            # interpolate trajectories and calculate distance to averaged trajectory
-            num_p = 11
-            left_tra_interpld = np.array([interpolate_tra(tra, num_p) for tra in left_tra])
-            left_diff2avg_square = (left_tra_interpld - left_tra_interpld.mean(axis=0)) ** 2
-            left_dist2avg = np.sqrt(left_diff2avg_square[:, :, 0] + left_diff2avg_square[:, :, 1])
-
-            right_tra_interpld = np.array([interpolate_tra(tra, num_p) for tra in right_tra])
-            right_diff2avg_square = (right_tra_interpld - right_tra_interpld.mean(axis=0)) ** 2
-            right_dist2avg = np.sqrt(right_diff2avg_square[:, :, 0] + right_diff2avg_square[:, :, 1])
-
-            dist2avg = np.concatenate((left_dist2avg, right_dist2avg), axis=0)
-            dist2avg = (dist2avg / pixel_per_m) * 1000  # convert to mm
-            # calculate the distances to average trajectory of each trajectory, and take mean
-            df.loc[i_video, 'tra_deviation'] = dist2avg.mean(axis=1).mean()  # log
-            # calculate the center point dispersion
-            df.loc[i_video, 'dispersion_center'] = dist2avg[:, int(num_p/2)].mean()  # log
-            # log dispersion at different phase of the trajectory
-            for i_p in range(num_p):
-                df.loc[i_video, f'dispersion{i_p}'] = dist2avg[:, i_p].mean()  # log
-
-            # calculate distance between trajectories and a straight line
-            center_port = df.loc[i_video, 'center_port']
-            left_port = df.loc[i_video, 'left_port']
-            right_port = df.loc[i_video, 'right_port']
-            left_tra_dis = [get_tra_dis2line(tra, center_port, left_port) for tra in left_tra]
-            right_tra_dis = [get_tra_dis2line(tra, center_port, right_port) for tra in right_tra]
-            all_dis = left_tra_dis + right_tra_dis
-            mean_dis = np.array(all_dis).mean()
-            df.loc[i_video, 'avg_tra_dis2line'] = mean_dis  # log
-
-            # calculate average velocity
-            tra_vel = [get_tra_avg_speed(tra) for tra in all_tra]
-            mean_velocity = np.array(tra_vel).mean()
-            df.loc[i_video, 'avg_tra_vel'] = mean_velocity  # log
-
-            # number of trajectories
-            num_tra = len(all_tra)
-            df.loc[i_video, 'num_tra'] = num_tra  # log
+    num_p = 11
+    tra_metrics_list = []
+    for i_video in np.flatnonzero(has_side_ports(df)):
+        tra_metrics_list.append(make_tra_metrics(df.loc[i_video, 'tra_dict_path'],
+                                                 df.loc[i_video, 'center_port'],
+                                                 df.loc[i_video, 'left_port'],
+                                                 df.loc[i_video, 'right_port'],
+                                                 num_p))
+    cohort = make_cohort_table(df, tra_metrics_list)
 
-    # plot dispersion at different phase of the trajectory
-    cols = [f'dispersion{i}' for i in range(num_p)]
-    control_data = df[df['genotype'] == 'control'].loc[:, cols]
-    rimKO_data = df[df['genotype'] == 'RIMcKO'].loc[:, cols]
+    # add the measures of every session to df at once
+    measures = get_session_measures(cohort, df, num_p).drop(columns=['mouse_name', 'genotype', 'session'])
+    df[measures.columns] = measures
 
-    x_axis = np.linspace(0, 1, num_p)
-    error_plot(x_axis,
-               data_list=[control_data, rimKO_data],
-               label_list=['Control', 'rimKO'],
-               color_list=['C0', 'C1'],
-               xlabel='Proportion of Trajectory',
-               ylabel='Dispersion (mm)',
-               fig_name='phase_dispersion',
-               test=True)
+    group_plot(df, num_p, n_workers, cohort=cohort)
 
-    # plot group comparison
+
+def get_groupings(measures_df, measures):
+    """
+    get the control and RIMcKO groups of the measures for each way of grouping sessions,
+    each way of grouping is a single groupby of the measures of all sessions
+    :param measures_df: DataFrame of the measures of every session, made by get_session_measures
+    :param measures: list of measures to compare
+    :return: dict of {grouping name: (control DataFrame, RIMcKO DataFrame)}, with the measures as columns
+    """
+    groupings = {}
+    # each dot in the plot is an animal per sessions
+    genotype_groups = dict(list(measures_df.groupby('genotype', sort=False)))
+    groupings['session12_dot_animalxsession'] = (genotype_groups['control'].loc[:, measures],
+                                                 genotype_groups['RIMcKO'].loc[:, measures])
+
+    # each dot in the plot is an animal averaged over two sessions
+    animal_df = measures_df.groupby(['genotype', 'mouse_name']).mean(numeric_only=True)
+    control_df = animal_df.loc['control']
+    rimKO_df = animal_df.loc['RIMcKO']
+    # drop data with incomplete sessions
+    rimKO_df = rimKO_df.drop(['rim12', 'rim124', 'rim137'])
+    groupings['session12_dot_animal'] = (control_df.loc[:, measures], rimKO_df.loc[:, measures])
+
+    # each dot in the plot is an animal in a single session
+    session_groups = dict(list(measures_df.groupby(['genotype', 'session'], sort=False)))
+    for session, grouping in (('TwoOdor-1', 'session1'), ('TwoOdor-2', 'session2')):
+        groupings[grouping] = (session_groups[('control', session)].loc[:, measures],
+                               session_groups[('RIMcKO', session)].loc[:, measures])
+    return groupings
+
+
+def group_plot(df, num_p=11, n_workers=1, force=False, cohort=None):
+    """
+    plot group comparisons of the measures of every session, see get_session_measures,
+    the statistics of all comparisons are computed at once before plotting, see stats.load_group_stats
+    :param df: DataFrame of sessions made by make_df
+    :param n_workers: number of worker processes to render figures, see figures.render_figures
+    :param force: whether to render all figures, even if their data did not change
+    :param cohort: DataFrame of all trajectories made by make_cohort_table, loaded from the measures of
+                   trajectories saved by make_tra_metrics if None
+    """
+    cohort = make_cohort_table(df) if cohort is None else cohort
     read_label_list = ['avg_tra_vel',
                        'num_tra',
                        'avg_tra_dis2line',
                        'tra_deviation',
                        'dispersion_center',
+                       'tra_dtw',
                        ]
+    cols = [f'dispersion{i}' for i in range(num_p)]
+    groupings = get_groupings(get_session_measures(cohort, df, num_p), read_label_list + cols)
+    group_stats = load_group_stats(groupings)
+
+    # plot dispersion at different phase of the trajectory
+    control_data, rimKO_data = groupings['session12_dot_animalxsession']
+    control_data = control_data.loc[:, cols]
+    rimKO_data = rimKO_data.loc[:, cols]
+
+    x_axis = np.linspace(0, 1, num_p)
+    jobs = [figure_job(get_fig_path('phase_dispersion'), error_plot,
+                       x_axis,
+                       data_list=[control_data, rimKO_data],
+                       label_list=['Control', 'rimKO'],
+                       color_list=['C0', 'C1'],
+                       xlabel='Proportion of Trajectory',
+                       ylabel='Dispersion (mm)',
+                       fig_name='phase_dispersion',
+                       test=True,
+                       stats=group_stats.loc['session12_dot_animalxsession'].loc[cols])]
+
+    # plot group comparison
     title_list = ['Averaged head speed',
                   'Number of trajectories',
                   'Averaged distance from \nline',
                   'Deviation from averaged \ntrajectory',
                   'Center point dispersion',
+                  'DTW distance from \naveraged path',
                   ]
     ylabel_list = ['Averaged Velocity (m/s)',
                    'Number of trajectories',
                    'Distance from line (mm)',
                    'Deviation from avg. tra. (mm)',
                    'Center point dispersion (mm)',
+                   'DTW distance from avg. path (mm)',
                    ]
     save_str_list = ['headspeed',
                      'num_tra',
                      'dis2line',
                      'deviation_tra',
                      'center_dispersion',
+                     'dtw_tra',
                      ]
+    title_suffixes = {'session12_dot_animalxsession': ", first 2 sessions",
+                      'session12_dot_animal': ", first 2 sessions",
+                      'session1': ", session 1",
+                      'session2': ", session 2"}
 
     for read_label, title, ylabel, save_str in zip(read_label_list, title_list, ylabel_list, save_str_list):
-        # each dot in the plot is an animal per sessions
-        control_data = df[df['genotype'] == 'control'].loc[:, read_label]
-        rimKO_data = df[df['genotype'] == 'RIMcKO'].loc[:, read_label]
-        two_set_scatter_plot(control_data, rimKO_data,
-                             labels=["RIM Control", 'RIM cKO$^{DA}$'],
-                             title_str=title+", first 2 sessions",
-                             ylabel=ylabel,
-                             save_str=save_str+'_session12_dot_animalxsession')
-
-        # each dot in the plot is an animal averaged over two sessions
-        control_df = df[df['genotype'] == 'control'].groupby('mouse_name').mean(numeric_only=True)
-        rimKO_df = df[df['genotype'] == 'RIMcKO'].groupby('mouse_name').mean(numeric_only=True)
-        # drop data with incomplete sessions
-        rimKO_df = rimKO_df.drop(['rim12', 'rim124', 'rim137'])
-        control_data = control_df.loc[:, read_label]
-        rimKO_data = rimKO_df.loc[:, read_label]
-        two_set_scatter_plot(control_data, rimKO_data,
-                             labels=["RIM Control", 'RIM cKO$^{DA}$'],
-                             title_str=title+", first 2 sessions",
-                             ylabel=ylabel,
-                             save_str=save_str+'_session12_dot_animal')
-
-        control_s1_data = df[(df['genotype'] == 'control') & (df['session'] == 'TwoOdor-1')].loc[:, read_label]
-        rimKO_s1_data = df[(df['genotype'] == 'RIMcKO') & (df['session'] == 'TwoOdor-1')].loc[:, read_label]
-        two_set_scatter_plot(control_s1_data, rimKO_s1_data,
-                             labels=["RIM Control", 'RIM cKO$^{DA}$'],
-                             title_str=title+", session 1",
-                             ylabel=ylabel,
-                             save_str=save_str+'_session1')
-
-        control_s2_data = df[(df['genotype'] == 'control') & (df['session'] == 'TwoOdor-2')].loc[:, read_label]
-        rimKO_s2_data = df[(df['genotype'] == 'RIMcKO') & (df['session'] == 'TwoOdor-2')].loc[:, read_label]
-        two_set_scatter_plot(control_s2_data, rimKO_s2_data,
-                             labels=["RIM Control", 'RIM cKO$^{DA}$'],
-                             title_str=title+", session 2",
-                             ylabel=ylabel,
-                             save_str=save_str+'_session2')
+        for grouping, (control_data, rimKO_data) in groupings.items():
+            jobs.append(figure_job(get_fig_path(save_str+'_'+grouping), two_set_scatter_plot,
+                                   control_data.loc[:, read_label], rimKO_data.loc[:, read_label],
+                                   labels=["RIM Control", 'RIM cKO$^{DA}$'],
+                                   title_str=title+title_suffixes[grouping],
+                                   ylabel=ylabel,
+                                   save_str=save_str+'_'+grouping,
+                                   stats=group_stats.loc[(grouping, read_label)]))
+    render_figures(jobs, n_workers, force)
@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import contextlib
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+records = []  # records of finished stages in this process
+active_records = []  # records of running stages, the innermost one is the last
+profile_stages = set()  # names of stages to run under cProfile
+profile_dir = './reports'
+
+
+def init_worker(stages=(), trace_memory=False):
+    """
+    set up instrumentation in a worker process the same way as in the main process
+    :param stages: names of stages to profile
+    :param trace_memory: whether to trace the peak memory allocated by each stage
+    """
+    profile_stages.update(stages)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def get_max_rss():
+    """
+    get the peak resident memory of the process so far, in MB
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+
+
+@contextlib.contextmanager
+def stage(name, session=None):
+    """
+    record wall time, CPU time, memory and item counts of a stage
+    :param name: name of the stage
+    :param session: name of the session, None for stages over all sessions
+    """
+    record = {'stage': name, 'session': session, 'pid': os.getpid(), 'counts': {}}
+    active_records.append(record)
+    profiler = cProfile.Profile() if name in profile_stages else None
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    wall_time = time.perf_counter()
+    cpu_time = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record['wall_time'] = time.perf_counter() - wall_time
+        record['cpu_time'] = time.process_time() - cpu_time
+        if tracemalloc.is_tracing():
+            record['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        record['max_rss_mb'] = get_max_rss()
+        if profiler is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+            profile_path = os.path.join(profile_dir, f'profile_{name}_{session or "all"}.prof')
+            profiler.dump_stats(profile_path)
+            record['profile'] = profile_path
+        active_records.pop()
+        records.append(record)
+
+
+def count(key, n=1):
+    """
+    add n items to a count of the running stage, nothing is recorded if no stage is running
+    :param key: name of the count, such as 'frames_scanned', 'trajectories' or 'figures'
+    """
+    if active_records:
+        counts = active_records[-1]['counts']
+        counts[key] = counts.get(key, 0) + n
+
+
+def pop_records():
+    """
+    get and clear the records of finished stages in this process
+    """
+    finished = list(records)
+    records.clear()
+    return finished
+
+
+def summarize(stage_records):
+    """
+    sum the records of each stage over sessions
+    :return: dict of {stage: summary}
+    """
+    summary = {}
+    for record in stage_records:
+        total = summary.setdefault(record['stage'], {'num_sessions': 0, 'wall_time': 0.0, 'cpu_time': 0.0,
+                                                     'max_rss_mb': None, 'counts': {}})
+        total['num_sessions'] += record['session'] is not None
+        total['wall_time'] += record['wall_time']
+        total['cpu_time'] += record['cpu_time']
+        if record['max_rss_mb'] is not None:
+            total['max_rss_mb'] = max(total['max_rss_mb'] or 0.0, record['max_rss_mb'])
+        for key, n in record['counts'].items():
+            total['counts'][key] = total['counts'].get(key, 0) + n
+    return summary
+
+
+def write_report(path, stage_records, **run_info):
+    """
+    write the records of a run into a json report
+    :param path: path of the report
+    :param stage_records: list of records made by stage
+    :param run_info: other information of the run, such as arguments and total wall time
+    """
+    report = dict(run_info)
+    report['summary'] = summarize(stage_records)
+    report['records'] = stage_records
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
@@ -0,0 +1,164 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy.signal import savgol_coeffs
+
+from group_analysis import pixel_per_m, fps
+from tra_store import load_trajectories, get_side_names
+
+savgol_window = None  # frames of the Savitzky-Golay filter, such as 7, positions are not smoothed if None
+savgol_polyorder = 2
+kinematics_columns = ['vx', 'vy', 'speed', 'acceleration', 'heading', 'curvature']
+
+
+def get_window_idx(offsets, half_width):
+    """
+    get the indices of the frames around every frame of a ragged array of trajectories,
+    frames beyond the ends of a trajectory are replaced by its first or last frame
+    :param offsets: array of size (number of trajectories + 1), trajectory i is points[offsets[i]:offsets[i+1]]
+    :param half_width: number of frames on each side
+    :return: array of size (total number of points, 2 * half_width + 1)
+    """
+    offsets = np.asarray(offsets)
+    lengths = np.diff(offsets)
+    starts = np.repeat(offsets[:-1], lengths)
+    ends = np.repeat(offsets[1:], lengths)
+    idx = np.arange(offsets[-1])[:, None] + np.arange(-half_width, half_width + 1)
+    return np.clip(idx, starts[:, None], ends[:, None] - 1)
+
+
+def differentiate(values, offsets):
+    """
+    derivative of every trajectory with respect to frames, by central differences inside the trajectory and
+    one-sided differences at its ends like np.gradient, all trajectories at once
+    :param values: array of size (total number of points, ...)
+    :return: array of the same size, NaN for trajectories of a single frame
+    """
+    idx = get_window_idx(offsets, 1)
+    span = (idx[:, 2] - idx[:, 0]).reshape((-1,) + (1,) * (values.ndim - 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (values[idx[:, 2]] - values[idx[:, 0]]) / span
+
+
+def savgol_derivatives(values, offsets, window, polyorder):
+    """
+    Savitzky-Golay smoothing and its first and second derivatives with respect to frames of every trajectory,
+    all trajectories at once, trajectories are extended by their first and last frame like mode='nearest'
+    of scipy.signal.savgol_filter
+    :param values: array of size (total number of points, ...)
+    :param window: odd number of frames of the filter
+    :param polyorder: order of the polynomial fitted in the window
+    :return: list of arrays of the smoothed values, and their first and second derivatives
+    """
+    windowed = values[get_window_idx(offsets, window // 2)]  # size (total number of points, window, ...)
+    return [np.tensordot(savgol_coeffs(window, polyorder, deriv=deriv, use='dot'), windowed, axes=(0, 1))
+            for deriv in range(3)]
+
+
+def get_kinematics(points, offsets, window=None, polyorder=savgol_polyorder):
+    """
+    calculate the kinematics at every frame of every trajectory of a session, in a single vectorized pass
+    over the ragged array
+    :param points: the first two cols of points are x and y positions in pixels, see tra_store
+    :param offsets: array of size (number of trajectories + 1), trajectory i is points[offsets[i]:offsets[i+1]]
+    :param window: number of frames of the Savitzky-Golay filter, derivatives are finite differences if None
+    :param polyorder: order of the polynomial of the Savitzky-Golay filter
+    :return: dict of arrays of size (total number of points), in the ragged layout of points,
+             vx, vy: velocity in m/s, speed in m/s, acceleration: norm of the acceleration in m/s^2,
+             heading: direction of the velocity in radians, curvature: signed curvature of the path in 1/m
+    """
+    xy = np.asarray(points[:, :2], dtype=np.float64) / pixel_per_m  # in m
+    if window is None:
+        velocity = differentiate(xy, offsets) * fps
+        acceleration = differentiate(velocity, offsets) * fps
+    else:
+        smoothed, velocity, acceleration = savgol_derivatives(xy, offsets, window, polyorder)
+        velocity = velocity * fps
+        acceleration = acceleration * fps ** 2
+        # as for finite differences, trajectories of a single frame have no velocity
+        single = np.repeat(np.diff(offsets) < 2, np.diff(offsets))
+        velocity[single] = np.nan
+        acceleration[single] = np.nan
+
+    vx, vy = velocity[:, 0], velocity[:, 1]
+    ax, ay = acceleration[:, 0], acceleration[:, 1]
+    speed = np.hypot(vx, vy)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        curvature = (vx * ay - vy * ax) / speed ** 3
+    return {
+        'vx': vx,
+        'vy': vy,
+        'speed': speed,
+        'acceleration': np.hypot(ax, ay),
+        'heading': np.arctan2(vy, vx),
+        'curvature': curvature,
+    }
+
+
+def summarize_kinematics(kinematics, offsets):
+    """
+    summarize the kinematics of every trajectory
+    :param kinematics: dict made by get_kinematics
+    :param offsets: array of size (number of trajectories + 1), trajectory i is points[offsets[i]:offsets[i+1]]
+    :return: DataFrame with one row per trajectory, columns are trial: index of the trajectory in the session,
+             mean_speed, peak_speed in m/s, time_to_peak: time from the start of the trajectory to the peak speed in s,
+             peak_acceleration in m/s^2
+    """
+    offsets = np.asarray(offsets)
+    lengths = np.diff(offsets)
+    tra_idx = np.repeat(np.arange(len(lengths)), lengths)
+    frame_idx = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+    speed = kinematics['speed']
+
+    summary = pd.DataFrame({'trial': np.arange(len(lengths))})
+    if len(lengths) == 0:
+        return summary.assign(mean_speed=[], peak_speed=[], time_to_peak=[], peak_acceleration=[])
+    summary['mean_speed'] = np.bincount(tra_idx, weights=speed, minlength=len(lengths)) / lengths
+    peak_speed = np.maximum.reduceat(speed, offsets[:-1])
+    summary['peak_speed'] = peak_speed
+    # first frame at the peak speed, the length of the trajectory if the speed is NaN
+    peak_frame = np.minimum.reduceat(np.where(speed == peak_speed[tra_idx], frame_idx, lengths[tra_idx]), offsets[:-1])
+    summary['time_to_peak'] = np.where(peak_frame < lengths, peak_frame / fps, np.nan)
+    summary['peak_acceleration'] = np.maximum.reduceat(kinematics['acceleration'], offsets[:-1])
+    return summary
+
+
+def get_kinematics_dir(tra_dict_path):
+    return os.path.join(tra_dict_path, 'kinematics')
+
+
+def get_kinematics_summary_path(tra_dict_path):
+    return os.path.join(tra_dict_path, 'kinematics_summary.csv')
+
+
+def make_kinematics(tra_dict_path, window=None, polyorder=savgol_polyorder):
+    """
+    calculate the kinematics of every trajectory of a session, see get_kinematics, and save the time series of
+    every frame and the summary of every trajectory next to the extracted trajectories
+    :return: DataFrame of the summary, see summarize_kinematics
+    """
+    points, offsets, side = load_trajectories(tra_dict_path)
+    kinematics = get_kinematics(points, offsets, window, polyorder)
+    kinematics_dir = get_kinematics_dir(tra_dict_path)
+    os.makedirs(kinematics_dir, exist_ok=True)
+    for name, values in kinematics.items():
+        np.save(os.path.join(kinematics_dir, name + '.npy'), values.astype(np.float32))
+
+    summary = summarize_kinematics(kinematics, offsets)
+    summary.insert(1, 'side', get_side_names(side))
+    summary.to_csv(get_kinematics_summary_path(tra_dict_path), index=False)
+    return summary
+
+
+def load_kinematics(tra_dict_path, mmap_mode='r'):
+    """
+    load the kinematics of every frame of a session saved by make_kinematics, memory-mapped by default
+    :return: dict of {name: array}, in the ragged layout of the trajectories, see get_kinematics
+    """
+    kinematics_dir = get_kinematics_dir(tra_dict_path)
+    return {name: np.load(os.path.join(kinematics_dir, name + '.npy'), mmap_mode=mmap_mode)
+            for name in kinematics_columns}
+
+
+def load_kinematics_summary(tra_dict_path):
+    return pd.read_csv(get_kinematics_summary_path(tra_dict_path), float_precision='round_trip')
@@ -1,42 +1,266 @@
-import json
+import os
+import time
+import argparse
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import numpy as np
 
-from make_dataframe import make_df
-from extract import extract_trajectories
+import make_dataframe
+from make_dataframe import make_df, get_session_ports
+import extract
+import dtw
+import kinematics
+from kinematics import make_kinematics, get_kinematics_dir, get_kinematics_summary_path
+from extract import extract_session
 import plots
-from group_analysis import group_ana, interpolate_tra
-from dist_analysis import dist_ana
+from group_analysis import group_plot, interpolate_tra_batch, make_tra_metrics, load_tra_metrics, \
+    get_tra_metrics_path, summarize_tra_metrics, has_side_ports
+from dist_analysis import get_dist_fig_job
+from figures import figure_job, render_figures, get_code_hash
+from tra_store import load_trajectories, split_trajectories
+from ports import make_ports, get_port_position
+from manifest import load_manifest, save_manifest, get_file_info, get_hash, is_up_to_date, update_entry
+import instrument
+
+
+def get_tra_fig_job(exp_name, tra_dict_path, center_port, left_port, right_port, num_p=50,
+                    rasterize=False, fig_format='pdf'):
+    """
+    get the job to render the trajectories of a single session, see figures.render_figures
+    :param num_p: number of points to interpolate the averaged trajectories
+    :param rasterize: whether to rasterize the trajectories, see plots.plot_trajectories
+    :param fig_format: format of the figure file, 'pdf' or 'png'
+    """
+    # load trajectories from files
+    points, offsets, side = load_trajectories(tra_dict_path)
+    all_tra = split_trajectories(np.asarray(points), offsets)
+
+    # interpolate trajectories
+    tra_interpld = interpolate_tra_batch(points, offsets, num_p)
+    left_tra_interpld = tra_interpld[side == 0]
+    right_tra_interpld = tra_interpld[side == 1]
+
+    return figure_job(plots.get_fig_path(exp_name + '_tra', fig_format),
+                      plots.plot_trajectories,
+                      exp_name,
+                      [tra for tra, s in zip(all_tra, side) if s == 0],
+                      [tra for tra, s in zip(all_tra, side) if s == 1],
+                      center_port,
+                      left_port,
+                      right_port,
+                      left_tra_interpld.mean(axis=0),
+                      right_tra_interpld.mean(axis=0),
+                      rasterize=rasterize,
+                      fig_format=fig_format)
+
 
+def plot_session_tra(exp_name, tra_dict_path, center_port, left_port, right_port, num_p=50,
+                     rasterize=False, fig_format='pdf', force=False):
+    """
+    plot trajectories of a single session, see get_tra_fig_job
+    :param force: whether to render the figure even if its data did not change, see figures.render_figures
+    """
+    render_figures([get_tra_fig_job(exp_name, tra_dict_path, center_port, left_port, right_port, num_p,
+                                    rasterize, fig_format)], force=force)
 
-def plot_all_tra(df):
+
+def plot_all_tra(df, n_workers=1):
     # plot trajectories
-    for i_video in range(len(df)):
-        # load trajectories from files
-        json_path = df.loc[i_video, 'tra_dict_path']
-        if json_path is not None:
-            f = open(json_path)
-            tra_dict = json.load(f)
-
-            left_tra = [np.array(tra) for tra in tra_dict['left_tra']]
-            right_tra = [np.array(tra) for tra in tra_dict['right_tra']]
-            # interpolate trajectories
-            num_p = 50
-            left_tra_interpld = np.array([interpolate_tra(tra, num_p) for tra in left_tra])
-            right_tra_interpld = np.array([interpolate_tra(tra, num_p) for tra in right_tra])
-
-            plots.plot_trajectories(df.loc[i_video, 'exp_name'],
-                                    tra_dict['left_tra'],
-                                    tra_dict['right_tra'],
+    jobs = []
+    for i_video in np.flatnonzero(has_side_ports(df)):
+        jobs.append(get_tra_fig_job(df.loc[i_video, 'exp_name'],
+                                    df.loc[i_video, 'tra_dict_path'],
                                     df.loc[i_video, 'center_port'],
                                     df.loc[i_video, 'left_port'],
-                                    df.loc[i_video, 'right_port'],
-                                    left_tra_interpld.mean(axis=0),
-                                    right_tra_interpld.mean(axis=0))
+                                    df.loc[i_video, 'right_port']))
+    render_figures(jobs, n_workers)
+
+
+def process_session(session, entry=None, chunk_size=None, rasterize=False, tra_fig_format='pdf', force=False,
+                    bodyparts=None):
+    """
+    run the per-session part of the pipeline: port location, extraction, measures and figures
+    sessions are independent of each other, so this can run in a worker process
+    :param session: dict, a row of the DataFrame made by make_df
+    :param entry: dict, manifest entry of the session from the previous run,
+                  stages whose inputs did not change are skipped and their previous results are reused
+    :param chunk_size: number of frames to scan at a time in extraction, see extract.extract_session
+    :param rasterize: whether to rasterize the trajectories in the trajectory figure
+    :param tra_fig_format: format of the trajectory figure, 'pdf' or 'png'
+    :param force: whether to render figures even if their data did not change, see figures.render_figures
+    :param bodyparts: list of other body parts to record along the nose, extract.tracked_bodyparts if None
+    :return: results: dict of results to be merged into the row of the session
+             entry: updated manifest entry of the session
+             records: instrumentation records of the stages that ran, see instrument.stage
+    """
+    print("Analyzing: ", session['exp_name'])
+    entry = {} if entry is None else dict(entry)
+    exp_name = session['exp_name']
+    csv_name = session['csv_path']
+    tra_dict_path = session['tra_dict_path']
+
+    # location of ports
+    ports_hash = get_hash(get_file_info(os.path.join('./data/TwoOdor', csv_name)),
+                          make_dataframe.port_estimator, make_dataframe.port_stride,
+                          make_dataframe.port_spread_quantile, extract.threshold, extract.port_radius)
+    if not is_up_to_date(entry, 'ports', ports_hash):
+        with instrument.stage('ports', exp_name):
+            ports, port_spread = get_session_ports(csv_name, make_dataframe.port_estimator, make_dataframe.port_stride,
+                                                   make_dataframe.port_spread_quantile)
+        update_entry(entry, 'ports', ports_hash, {'names': ports['names'],
+                                                  'ports': ports['positions'].tolist(),
+                                                  'radius': ports['radius'].tolist(),
+                                                  'spreads': ports['spread'].tolist(),
+                                                  'spread': float(port_spread)})
+    ports_result = entry['ports']['result']
+    ports = make_ports(ports_result['names'], ports_result['ports'], ports_result['radius'], ports_result['spreads'])
+    center_port, left_port, right_port = [get_port_position(ports, name)
+                                          for name in ('centerport', 'leftport', 'rightport')]
+
+    # extraction
+    bodyparts = extract.tracked_bodyparts if bodyparts is None else bodyparts
+    extract_hash = get_hash(ports_hash, ports_result, extract.origin_ports,
+                            extract.fps, extract.max_tra_len, bodyparts)
+    if not is_up_to_date(entry, 'extract', extract_hash, [os.path.join(tra_dict_path, 'points.npy')]):
+        with instrument.stage('extract', exp_name):
+            num_tra = extract_session(csv_name, ports, tra_dict_path, chunk_size, bodyparts)
+        update_entry(entry, 'extract', extract_hash, num_tra)
+
+    # kinematics of every frame, and their summary for every trajectory
+    kinematics_hash = get_hash(extract_hash, kinematics.savgol_window, kinematics.savgol_polyorder)
+    kinematics_paths = [os.path.join(get_kinematics_dir(tra_dict_path), name + '.npy')
+                        for name in kinematics.kinematics_columns] + [get_kinematics_summary_path(tra_dict_path)]
+    if not is_up_to_date(entry, 'kinematics', kinematics_hash, kinematics_paths):
+        with instrument.stage('kinematics', exp_name):
+            summary = make_kinematics(tra_dict_path, kinematics.savgol_window, kinematics.savgol_polyorder)
+        update_entry(entry, 'kinematics', kinematics_hash, {'avg_peak_speed': float(summary['peak_speed'].mean()),
+                                                            'avg_time_to_peak': float(summary['time_to_peak'].mean())})
+
+    results = {
+        'ports': ports,
+        'center_port': center_port,
+        'left_port': left_port,
+        'right_port': right_port,
+        'port_spread': entry['ports']['result']['spread'],
+    }
+    results.update(entry['kinematics']['result'])
+
+    # the trajectory figure and the measures of trajectories compare the left and right sides
+    if center_port is None or left_port is None or right_port is None:
+        print(f'warning: {exp_name} does not have a centerport, leftport and rightport, '
+              f'its trajectory figure and measures are skipped')
+        return results, entry, instrument.pop_records()
+
+    # trajectory figure
+    num_p = 50
+    tra_fig_hash = get_hash(extract_hash, num_p, rasterize, tra_fig_format, get_code_hash(plots.__name__))
+    tra_fig_path = plots.get_fig_path(exp_name + '_tra', tra_fig_format)
+    if not is_up_to_date(entry, 'tra_fig', tra_fig_hash, [tra_fig_path]):
+        with instrument.stage('tra_fig', exp_name):
+            plot_session_tra(exp_name, tra_dict_path, center_port, left_port, right_port, num_p,
+                             rasterize, tra_fig_format, force)
+        update_entry(entry, 'tra_fig', tra_fig_hash)
+
+    # measures of every trajectory, shared by the distance figure and the group analysis
+    num_p = 11
+    metrics_hash = get_hash(extract_hash, num_p, dtw.num_ref, dtw.band)
+    tra_metrics = None
+    if not is_up_to_date(entry, 'metrics', metrics_hash, [get_tra_metrics_path(tra_dict_path)]):
+        with instrument.stage('metrics', exp_name):
+            tra_metrics = make_tra_metrics(tra_dict_path, center_port, left_port, right_port, num_p)
+            metrics = summarize_tra_metrics(tra_metrics, num_p)
+        update_entry(entry, 'metrics', metrics_hash, {key: float(value) for key, value in metrics.items()})
+
+    dist_fig_hash = get_hash(metrics_hash, get_code_hash(get_dist_fig_job.__module__))
+    if not is_up_to_date(entry, 'dist_fig', dist_fig_hash, [plots.get_fig_path(exp_name + '_dist')]):
+        with instrument.stage('dist_fig', exp_name):
+            if tra_metrics is None:
+                tra_metrics = load_tra_metrics(tra_dict_path)
+            render_figures([get_dist_fig_job(exp_name, tra_metrics)], force=force)
+        update_entry(entry, 'dist_fig', dist_fig_hash)
+
+    results.update(entry['metrics']['result'])
+    return results, entry, instrument.pop_records()
+
+
+def run_sessions(df, n_workers=1, force=False, chunk_size=None, rasterize=False, tra_fig_format='pdf',
+                 bodyparts=None):
+    """
+    run process_session on all sessions, and merge the results into df in order of sessions
+    :param df: DataFrame made by make_df
+    :param n_workers: number of worker processes, sessions run in the current process if it is 1
+    :param force: whether to rerun all stages, even if their inputs did not change
+    :param chunk_size: number of frames to scan at a time in extraction, see extract.extract_session
+    :param rasterize: whether to rasterize the trajectories in the trajectory figures
+    :param tra_fig_format: format of the trajectory figures, 'pdf' or 'png'
+    :param bodyparts: list of other body parts to record along the nose, extract.tracked_bodyparts if None
+    :return: instrumentation records of the stages that ran, in order of sessions
+    """
+    manifest = load_manifest()
+    i_videos = [i_video for i_video in range(len(df)) if df.loc[i_video, 'csv_path'] is not None]
+    sessions = [df.loc[i_video].to_dict() for i_video in i_videos]
+    entries = [None if force else manifest.get(session['exp_name']) for session in sessions]
+    run_session = partial(process_session, chunk_size=chunk_size, rasterize=rasterize, tra_fig_format=tra_fig_format,
+                          force=force, bodyparts=bodyparts)
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=instrument.init_worker,
+                                 initargs=(instrument.profile_stages, tracemalloc.is_tracing())) as pool:
+            outputs = list(pool.map(run_session, sessions, entries))
+    else:
+        outputs = list(map(run_session, sessions, entries))
+
+    stage_records = []
+    for i_video, (results, entry, records) in zip(i_videos, outputs):
+        for key, value in results.items():
+            df.at[i_video, key] = value
+        manifest[df.loc[i_video, 'exp_name']] = entry
+        stage_records += records
+    save_manifest(manifest)
+    return stage_records
 
 
 if __name__ == '__main__':
-    df = make_df()
-    extract_trajectories(df)
-    plot_all_tra(df)
-    group_ana(df)
-    dist_ana(df)
+    parser = argparse.ArgumentParser(description='analyze mice behavior from DLC tracking data')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes for the per-session analysis')
+    parser.add_argument('--force', action='store_true',
+                        help='rerun all stages, instead of reusing the results of stages whose inputs did not change')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='number of frames to scan at a time in extraction, to bound the memory on long recordings')
+    parser.add_argument('--bodyparts', nargs='+', default=None,
+                        help='other body parts to record along the nose in every trajectory, such as head body')
+    parser.add_argument('--discover', action='store_true',
+                        help='also analyze DLC csv files in ./data/TwoOdor that are not in sessions.csv')
+    parser.add_argument('--rasterize', action='store_true',
+                        help='rasterize the trajectories in the trajectory figures, which makes smaller pdf files')
+    parser.add_argument('--tra-fig-format', default='pdf', choices=['pdf', 'png'],
+                        help='format of the trajectory figures')
+    parser.add_argument('--report', default=None,
+                        help='path of the json report of the run, ./reports/run_<time>.json by default')
+    parser.add_argument('--profile', default=None,
+                        choices=['ports', 'extract', 'kinematics', 'tra_fig', 'metrics', 'dist_fig', 'group_fig'],
+                        help='run a stage under cProfile, the stats are saved in ./reports')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='trace the peak memory allocated by each stage, which slows down the run')
+    args = parser.parse_args()
+
+    start_time = time.strftime('%Y%m%d-%H%M%S')
+    wall_time = time.perf_counter()
+    instrument.init_worker([args.profile] if args.profile else [], args.trace_memory)
+
+    df = make_df(locate_ports=False, discover=args.discover)
+    stage_records = run_sessions(df, args.workers, args.force, args.chunk_size, args.rasterize, args.tra_fig_format,
+                                 args.bodyparts)
+    with instrument.stage('group_fig'):
+        group_plot(df, n_workers=args.workers, force=args.force)
+    stage_records += instrument.pop_records()
+
+    report_path = args.report or os.path.join('./reports', f'run_{start_time}.json')
+    instrument.write_report(report_path, stage_records,
+                            start_time=start_time,
+                            wall_time=time.perf_counter() - wall_time,
+                            args=vars(args))
+    print('run report saved to', report_path)
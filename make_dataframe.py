@@ -1,77 +1,179 @@
 import os
+import glob
+import functools
 import numpy as np
 import pandas as pd
+import scipy.stats
 
+import extract
 from extract import distance
-
-
-def get_port_loc(df, name):
-    x_array = df.loc[:, (name, 'x')]
-    y_array = df.loc[:, (name, 'y')]
+from session_cache import load_session
+from ports import get_port_names, make_ports, get_port_position
+from instrument import count
+
+port_estimator = 'median'
+port_stride = 10  # ports are located from every 10th frame
+max_port_spread = 5  # pixels, sessions with a larger spread of port positions are flagged
+port_spread_quantile = 90  # the spread of a port is this percentile of the distances of its positions
+session_list_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.csv')
+
+
+def get_port_loc(data, name, estimator='mean', stride=1, n_samples=None, seed=0, spread_quantile=90):
+    """
+    locate a port from the tracked positions of its body part, frames of low likelihood are left out
+    :param data: dict of {(bodypart, coord): array}, see session_cache.load_session
+    :param name: body part of the port
+    :param estimator: 'mean', 'median' or 'trim_mean' (mean of the positions between 10% and 90% quantiles)
+    :param stride: use every stride-th frame, ports do not move so a subsample of frames is enough
+    :param n_samples: number of frames randomly sampled from the strided frames, all of them if None
+    :param seed: seed of the random sampling
+    :param spread_quantile: percentile of the distances of the positions to the location that is reported as
+                            the spread, a high percentile sees a shift of the port in a minority of the frames
+    :return: x, y: location of the port in pixels,
+             spread: spread_quantile percentile of the distances of the positions to the location in pixels,
+             a large spread means the port was not tracked well or the camera moved during the session
+    """
+    x_array = data[(name, 'x')][::stride]
+    y_array = data[(name, 'y')][::stride]
+    ll_array = data[(name, 'likelihood')][::stride]
+    if n_samples is not None and n_samples < len(ll_array):
+        sample_idx = np.sort(np.random.default_rng(seed).choice(len(ll_array), n_samples, replace=False))
+        x_array, y_array, ll_array = x_array[sample_idx], y_array[sample_idx], ll_array[sample_idx]
 
     # filter low likelihood points
-    ll_array = df.loc[:, (name, 'likelihood')]
-    filter_idx = ll_array < 0.98
-    x_array.loc[filter_idx] = np.nan
-    y_array.loc[filter_idx] = np.nan
+    keep_idx = ll_array >= 0.98
+    xy = np.stack((x_array[keep_idx], y_array[keep_idx]), axis=1).astype(np.float64)
+    if len(xy) == 0:
+        return np.nan, np.nan, np.nan
 
     # filter outliers for port positions
-
-    return x_array.mean(), y_array.mean()
-
-
-def make_df():
-    data_frame = pd.DataFrame(
-        {
-            "mouse_name": ['rim10', 'rim10', 'rim106', 'rim106',
-                           'rim123', 'rim123', 'rim138', 'rim138',
-                           'rim139', 'rim139', 'rim145', 'rim145',
-                           'rim12', 'rim12', 'rim108', 'rim108',
-                           'rim124', 'rim124', 'rim136', 'rim136',
-                           'rim137', 'rim137', 'rim141', 'rim141'],
-            "genotype": ['control', 'control', 'control', 'control',
-                         'control', 'control', 'control', 'control',
-                         'control', 'control', 'control', 'control',
-                         'RIMcKO', 'RIMcKO', 'RIMcKO', 'RIMcKO',
-                         'RIMcKO', 'RIMcKO', 'RIMcKO', 'RIMcKO',
-                         'RIMcKO', 'RIMcKO', 'RIMcKO', 'RIMcKO'],
-            "session": ['TwoOdor-1', 'TwoOdor-2', 'TwoOdor-1', 'TwoOdor-2',
-                        'TwoOdor-1', 'TwoOdor-2', 'TwoOdor-1', 'TwoOdor-2',
-                        'TwoOdor-1', 'TwoOdor-2', 'TwoOdor-1', 'TwoOdor-2',
-                        'TwoOdor-1', 'TwoOdor-2', 'TwoOdor-1', 'TwoOdor-2',
-                        'TwoOdor-1', 'TwoOdor-2', 'TwoOdor-1', 'TwoOdor-2',
-                        'TwoOdor-1', 'TwoOdor-2', 'TwoOdor-1', 'TwoOdor-2'],
-            "csv_path": ['rim10_2019-12-02-085240-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim10_2019-12-03-083501-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim106_2019-12-09-085330-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim106_2019-12-10-082017-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim123_2019-11-30-082443-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim123_2019-12-01-082615-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim138_2019-11-29-094734-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim138_2019-11-30-092231-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim139_2019-11-28-115422-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim139_2019-11-29-113907-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim145_2019-11-28-115441-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim145_2019-11-29-113923-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim12_2019-12-09-100215-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         None,
-                         'rim108_2019-12-11-094329-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim108_2019-12-12-094016-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim124_2019-12-10-095942-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         None,
-                         'rim136_2019-11-28-103604-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim136_2019-11-29-103936-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim137_2019-12-10-113052-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         None,
-                         'rim141_2019-12-23-104658-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv',
-                         'rim141_2019-12-24-102330-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv'],
-            "exp_name": None,
-            "center_port": None,
-            "left_port": None,
-            "right_port": None,
-            "tra_dict_path": None,
-        }
-    )
+    if estimator == 'mean':
+        x, y = xy.mean(axis=0)
+    elif estimator == 'median':
+        x, y = np.median(xy, axis=0)
+    elif estimator == 'trim_mean':
+        x, y = scipy.stats.trim_mean(xy, 0.1, axis=0)
+    else:
+        raise ValueError(f'unknown estimator {estimator}')
+    spread = np.percentile(np.hypot(xy[:, 0] - x, xy[:, 1] - y), spread_quantile)
+    return x, y, spread
+
+
+def get_session_ports(csv_name, estimator=None, stride=None, spread_quantile=None):
+    """
+    locate the ports of a session, computed once for each session and settings in a process,
+    every body part whose name ends with 'port' in the DLC csv file is a port, see ports.get_port_names
+    :param csv_name: name of the DLC csv file in ./data/TwoOdor
+    :param estimator: estimator of port locations, see get_port_loc, port_estimator if None
+    :param stride: use every stride-th frame to locate ports, port_stride if None
+    :param spread_quantile: percentile of the distances reported as the spread, port_spread_quantile if None
+    :return: ports: dict, port model of the arena made by ports.make_ports, the radius of each port is
+             extract.port_radius or extract.threshold, and the spread of each port is in ports['spread'],
+             port_spread: the largest spread of the ports in pixels, see get_port_loc
+    """
+    estimator = port_estimator if estimator is None else estimator
+    stride = port_stride if stride is None else stride
+    spread_quantile = port_spread_quantile if spread_quantile is None else spread_quantile
+    return locate_ports(csv_name, estimator, stride, spread_quantile)
+
+
+@functools.lru_cache(maxsize=None)
+def locate_ports(csv_name, estimator, stride, spread_quantile):
+    """
+    locate the ports of a session with the given settings, see get_session_ports
+    """
+    filename = os.path.join('./data/TwoOdor', csv_name)
+    names = get_port_names(filename)
+    data = load_session(filename, names, mmap_mode='r')
+    count('frames_scanned', len(data[(names[0], 'x')][::stride]))
+
+    locations = [get_port_loc(data, name, estimator, stride, spread_quantile=spread_quantile)
+                 for name in names]
+    port_spread = max(spread for x, y, spread in locations)
+    ports = make_ports(names, [(x, y) for x, y, spread in locations],
+                       [extract.port_radius.get(name, extract.threshold) for name in names],
+                       [spread for x, y, spread in locations])
+
+    center_port = get_port_position(ports, 'centerport')
+    for side_name in ('left', 'right'):
+        side_port = get_port_position(ports, side_name + 'port')
+        if center_port is not None and side_port is not None:
+            print(f'center to {side_name} distance (pixels): ', distance(*center_port, *side_port))
+    if not port_spread <= max_port_spread:
+        print(f'warning: spread of port positions is {port_spread:.1f} pixels, '
+              f'the camera may have moved in {csv_name}')
+
+    return ports, port_spread
+
+
+def read_session_list(path=session_list_path):
+    """
+    read the list of sessions
+    :param path: path of a csv file with columns mouse_name, genotype, session and csv_path,
+                 csv_path is the name of the DLC csv file in ./data/TwoOdor, left empty for sessions without one
+    :return: DataFrame, csv_path is None for sessions without a DLC csv file
+    """
+    session_list = pd.read_csv(path, dtype=str, keep_default_na=False)
+    session_list['csv_path'] = session_list['csv_path'].where(session_list['csv_path'] != '', None)
+    return session_list.loc[:, ['mouse_name', 'genotype', 'session', 'csv_path']]
+
+
+def discover_sessions(session_list, data_dir='./data/TwoOdor', pattern='*DLC_*.csv'):
+    """
+    find DLC csv files that are not in the list of sessions
+    the mouse name and recording time are taken from the file name, such as
+    rim10_2019-12-02-085240-0000DLC_resnet50_RIMdataSep11shuffle1_500000.csv, the genotype is unknown
+    :param session_list: DataFrame made by read_session_list
+    :return: DataFrame of the new sessions, with the columns of session_list
+    """
+    listed = set(session_list['csv_path'].dropna())
+    new_sessions = []
+    for csv_path in sorted(glob.glob(os.path.join(data_dir, pattern))):
+        csv_name = os.path.basename(csv_path)
+        if csv_name not in listed:
+            mouse_name, _, recording = csv_name.split('DLC_')[0].partition('_')
+            new_sessions.append({'mouse_name': mouse_name,
+                                 'genotype': 'unknown',
+                                 'session': recording,
+                                 'csv_path': csv_name})
+    return pd.DataFrame(new_sessions, columns=session_list.columns)
+
+
+def locate_session_ports(data_frame, i_video):
+    """
+    set the location of the ports of a session in a DataFrame made by make_df(locate_ports=False),
+    ports are only located when a session is first accessed, see get_session_ports
+    :return: ports: dict, port model of the arena made by ports.make_ports
+    """
+    if data_frame.loc[i_video, 'ports'] is None:
+        ports, port_spread = get_session_ports(data_frame.loc[i_video, 'csv_path'])
+        data_frame.at[i_video, 'ports'] = ports
+        data_frame.at[i_video, 'center_port'] = get_port_position(ports, 'centerport')
+        data_frame.at[i_video, 'left_port'] = get_port_position(ports, 'leftport')
+        data_frame.at[i_video, 'right_port'] = get_port_position(ports, 'rightport')
+        data_frame.at[i_video, 'port_spread'] = port_spread
+    return data_frame.loc[i_video, 'ports']
+
+
+def make_df(locate_ports=True, session_list_path=session_list_path, discover=False):
+    """
+    make the DataFrame of all sessions
+    :param locate_ports: whether to set the location of ports, otherwise they are left as None,
+                         and can be located for the sessions in use by locate_session_ports
+    :param session_list_path: path of the list of sessions, see read_session_list
+    :param discover: whether to add DLC csv files in ./data/TwoOdor that are not in the list, see discover_sessions
+    """
+    session_list = read_session_list(session_list_path)
+    if discover:
+        session_list = pd.concat([session_list, discover_sessions(session_list)], ignore_index=True)
+
+    data_frame = session_list.assign(exp_name=None,
+                                     ports=None,
+                                     center_port=None,
+                                     left_port=None,
+                                     right_port=None,
+                                     port_spread=None,
+                                     tra_dict_path=None)
 
     for i_video in range(len(data_frame)):
         # load data
@@ -84,27 +186,12 @@ def make_df():
         if csv_name is not None:
 
             # set tra_dict_path
-            tra_dict_path = exp + "tra_dict.json"
+            tra_dict_path = exp + "tra_dict"
             full_tra_dict_path = os.path.join('./', 'data', 'extracted_trajectories', tra_dict_path)
             data_frame.loc[i_video, 'tra_dict_path'] = full_tra_dict_path
 
             # set location of ports
-            filename = os.path.join('./data/TwoOdor', csv_name)
-            data = pd.read_csv(filename, header=[1, 2], index_col=0)
-
-            centerport_x, centerport_y = get_port_loc(data, 'centerport')
-            leftport_x, leftport_y = get_port_loc(data, 'leftport')
-            rightport_x, rightport_y = get_port_loc(data, 'rightport')
-
-            print(f'center to left distance (pixels): ',
-                  distance(centerport_x, centerport_y, leftport_x, leftport_y))
-            print(f'center to right distance (pixels): ',
-                  distance(centerport_x, centerport_y, rightport_x, rightport_y))
-
-            data_frame.loc[i_video, 'center_port'] = (centerport_x, centerport_y)
-            data_frame.loc[i_video, 'left_port'] = (leftport_x, leftport_y)
-            data_frame.loc[i_video, 'right_port'] = (rightport_x, rightport_y)
+            if locate_ports:
+                locate_session_ports(data_frame, i_video)
 
     return data_frame
-
-
@@ -0,0 +1,55 @@
+import os
+import json
+import hashlib
+
+manifest_path = './data/manifest.json'
+
+
+def load_manifest():
+    """
+    load the manifest of the previous run
+    :return: dict, {exp_name: {stage: {'hash': hash of the inputs of the stage, 'result': result of the stage}}}
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def get_file_info(filename):
+    """
+    get the fingerprint of a file, which changes whenever the file is rewritten
+    """
+    stat = os.stat(filename)
+    return [os.path.abspath(filename), stat.st_size, stat.st_mtime_ns]
+
+
+def get_hash(*inputs):
+    """
+    get the hash of json serializable inputs and parameters of a stage
+    """
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def is_up_to_date(entry, stage, input_hash, outputs=()):
+    """
+    check whether a stage can be skipped
+    :param entry: dict, manifest entry of a session
+    :param stage: name of the stage
+    :param input_hash: hash of the current inputs of the stage
+    :param outputs: paths of the outputs of the stage, which have to exist
+    """
+    return (stage in entry
+            and entry[stage]['hash'] == input_hash
+            and all(os.path.exists(path) for path in outputs))
+
+
+def update_entry(entry, stage, input_hash, result=None):
+    entry[stage] = {'hash': input_hash, 'result': result}
@@ -0,0 +1,115 @@
+import numpy as np
+
+from group_analysis import interpolate_tra, interpolate_tra_batch, pixel_per_m
+from tra_store import load_trajectories, select_trajectories
+
+
+class TrajectoryMoments:
+    """
+    running mean trajectory and dispersion of interpolated trajectories, updated as trajectories arrive,
+    with Welford's algorithm for a single trajectory and its pairwise form for a batch or another accumulator,
+    it takes O(num_p) memory whatever the number of trajectories
+    the dispersion reported is the root mean square distance to the mean trajectory at each phase, which is exact
+    at any time, unlike the mean distance of get_tra_metrics, which needs every trajectory once the mean is known
+    """
+
+    def __init__(self, num_p=11):
+        """
+        :param num_p: number of points to interpolate the trajectories
+        """
+        self.num_p = num_p
+        self.n = 0
+        self.mean = np.zeros((num_p, 2))
+        # sum of squared differences from the mean, for x and y at each phase
+        self.m2 = np.zeros((num_p, 2))
+
+    def update(self, n, mean, m2):
+        """
+        merge the moments of another set of trajectories
+        :param n: number of trajectories
+        :param mean: their mean trajectory, size (num_p, 2)
+        :param m2: their sum of squared differences from the mean, size (num_p, 2)
+        """
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.n * n / total)
+        self.n = total
+
+    def add(self, trajectory):
+        """
+        add a single trajectory, see group_analysis.interpolate_tra
+        :param trajectory: the first two cols of trajectory are x and y positions in pixels
+        """
+        tra_interpld = interpolate_tra(np.asarray(trajectory, dtype=np.float64), self.num_p)
+        self.update(1, tra_interpld, np.zeros((self.num_p, 2)))
+
+    def add_batch(self, points, offsets):
+        """
+        add a ragged array of trajectories, see tra_store.save_trajectories
+        """
+        if len(offsets) < 2:
+            return
+        tra_interpld = interpolate_tra_batch(np.asarray(points[:, :2], dtype=np.float64), offsets, self.num_p)
+        mean = tra_interpld.mean(axis=0)
+        self.update(len(tra_interpld), mean, ((tra_interpld - mean) ** 2).sum(axis=0))
+
+    def merge(self, other):
+        """
+        merge another accumulator, such as the one of another session or of a worker process
+        """
+        self.update(other.n, other.mean, other.m2)
+
+    def get_mean_trajectory(self):
+        """
+        :return: the mean trajectory, size (num_p, 2) in pixels, NaN if no trajectory was added
+        """
+        return self.mean if self.n > 0 else np.full((self.num_p, 2), np.nan)
+
+    def get_dispersion(self):
+        """
+        :return: root mean square distance of the trajectories to the mean trajectory at each phase, in mm,
+                 NaN if no trajectory was added
+        """
+        if self.n == 0:
+            return np.full(self.num_p, np.nan)
+        return (np.sqrt(self.m2.sum(axis=1) / self.n) / pixel_per_m) * 1000
+
+
+def get_session_moments(points, offsets, side, num_p=11):
+    """
+    get the moments of the trajectories of a session on each side
+    :param points: the first two cols of points are x and y positions in pixels, see tra_store
+    :param offsets: array of size (number of trajectories + 1), trajectory i is points[offsets[i]:offsets[i+1]]
+    :param side: array of size (number of trajectories), 0 for left trajectories, 1 for right trajectories,
+                 trajectories to other ports (-1) are left out
+    :return: dict of {'left': TrajectoryMoments, 'right': TrajectoryMoments}
+    """
+    side = np.asarray(side)
+    moments = {}
+    for s, side_name in enumerate(['left', 'right']):
+        moments[side_name] = TrajectoryMoments(num_p)
+        moments[side_name].add_batch(*select_trajectories(points, offsets, np.flatnonzero(side == s)))
+    return moments
+
+
+def get_cohort_moments(df, keys=('genotype',), num_p=11):
+    """
+    get the moments of the trajectories of groups of sessions on each side, sessions are loaded one at a time,
+    so only the moments of each group are kept in memory
+    :param df: DataFrame of sessions made by make_df
+    :param keys: columns of df that define the groups
+    :param num_p: number of points to interpolate the trajectories
+    :return: dict of {(key values..., side): TrajectoryMoments}
+    """
+    moments = {}
+    for i_video in range(len(df)):
+        tra_dict_path = df.loc[i_video, 'tra_dict_path']
+        if tra_dict_path is not None:
+            group = tuple(df.loc[i_video, key] for key in keys)
+            session_moments = get_session_moments(*load_trajectories(tra_dict_path), num_p)
+            for side_name, side_moments in session_moments.items():
+                moments.setdefault(group + (side_name,), TrajectoryMoments(num_p)).merge(side_moments)
+    return moments
@@ -0,0 +1,178 @@
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+
+import extract
+from extract import get_origins, get_side, new_scan_state, get_trial_windows, extract_session
+from make_dataframe import get_session_ports
+from ports import nearest_port
+from session_cache import iter_session_chunks
+from tra_store import load_trajectories, load_trial_ports
+
+
+class OnlineExtractor:
+    """
+    segment trials while a session is being recorded, nose positions are pushed one frame or a small batch
+    of frames at a time, and each trial is returned as soon as the nose reaches its destination port,
+    trials are the same as extract.extract_session finds in the whole session
+    """
+
+    def __init__(self, ports, origins=None, min_dwell_frames=5):
+        """
+        :param ports: dict, port model of the arena made by ports.make_ports
+        :param origins: list of names of the ports where trials start, see extract.get_origins
+        :param min_dwell_frames: number of consecutive frames in an origin port needed to trigger recording
+        """
+        self.ports = ports
+        self.is_origin = get_origins(ports, origins)
+        self.min_dwell_frames = min_dwell_frames
+        self.state = new_scan_state()
+        # read when the extractor is made, like extract_session reads them when it is called
+        self.max_len = extract.max_tra_len * extract.fps
+        # x, y and frame index of the unfinished trial, trials longer than max_len are not recorded
+        self.buffer = np.empty((self.max_len, 3))
+        self.n_buffered = 0
+
+    def push(self, x, y):
+        """
+        scan a single frame, it takes the same time for every frame
+        :param x: x position of the nose
+        :param y: y position of the nose
+        :return: (points, origin, destination) of the trial that ended at this frame, None otherwise,
+                 points is an array of size (length, 3) of x, y and frame index as in tra_store,
+                 origin and destination are the index of the ports where the trial started and ended
+        """
+        x = np.float32(x)
+        y = np.float32(y)
+        port = int(nearest_port([x], [y], self.ports)[0])
+        state = self.state
+        frame = state['frame']
+        dwell_port = state['dwell_port']
+
+        trial = None
+        if state['tra_start'] is None and port != dwell_port and dwell_port >= 0 \
+                and state['dwell_count'] >= self.min_dwell_frames and self.is_origin[dwell_port]:
+            state['tra_start'], state['tra_origin'] = frame, dwell_port
+            self.n_buffered = 0
+        if state['tra_start'] is not None:
+            if self.n_buffered < self.max_len:
+                self.buffer[self.n_buffered] = x, y, frame
+            self.n_buffered += 1
+            if port >= 0:
+                # trials back to the origin port and trials that are too long are dropped
+                if port != state['tra_origin'] and self.n_buffered <= self.max_len:
+                    trial = self.buffer[:self.n_buffered].copy(), state['tra_origin'], port
+                state['tra_start'], state['tra_origin'] = None, -1
+
+        state['dwell_count'] = state['dwell_count'] + 1 if port >= 0 and port == dwell_port else int(port >= 0)
+        state['dwell_port'] = port
+        state['frame'] = frame + 1
+        return trial
+
+    def push_batch(self, x, y):
+        """
+        scan a batch of consecutive frames, see extract.get_trial_windows
+        :param x: array of x positions of the nose
+        :param y: array of y positions of the nose
+        :return: list of (points, origin, destination) of the trials that ended in the batch, see push
+        """
+        x = np.asarray(x, dtype=np.float32)
+        y = np.asarray(y, dtype=np.float32)
+        port_idx = nearest_port(x, y, self.ports)
+        first_frame = self.state['frame']
+        starts, ends, origin, destination = get_trial_windows(port_idx, self.is_origin, self.min_dwell_frames,
+                                                              self.state)
+
+        trials = []
+        for start, end, trial_origin, trial_destination in zip(starts, ends, origin, destination):
+            if trial_destination == trial_origin or end - start + 1 > self.max_len:
+                continue
+            # frames before the batch are in the buffer
+            n_prev = max(first_frame - start, 0)
+            points = np.empty((end - start + 1, 3))
+            points[:n_prev] = self.buffer[:n_prev]
+            points[n_prev:] = self.get_points(x, y, first_frame, start + n_prev, end + 1)
+            trials.append((points, int(trial_origin), int(trial_destination)))
+
+        # keep the positions of the unfinished trial
+        tra_start = self.state['tra_start']
+        if tra_start is not None:
+            if tra_start >= first_frame:
+                self.n_buffered = 0
+            start = tra_start + self.n_buffered
+            stop = min(self.state['frame'], tra_start + self.max_len)
+            if start < stop:
+                self.buffer[self.n_buffered:self.n_buffered + stop - start] = \
+                    self.get_points(x, y, first_frame, start, stop)
+            self.n_buffered = self.state['frame'] - tra_start
+        return trials
+
+    @staticmethod
+    def get_points(x, y, first_frame, start, stop):
+        # rows of x, y and frame index of frames start to stop (exclusive) of a batch beginning at first_frame
+        return np.stack((x[start - first_frame:stop - first_frame], y[start - first_frame:stop - first_frame],
+                         np.arange(start, stop)), axis=1)
+
+
+def replay_session(csv_name, batch_size=1, chunk_size=100000):
+    """
+    stream the nose positions of a recorded session through an OnlineExtractor
+    :param csv_name: name of the DLC csv file in ./data/TwoOdor
+    :param batch_size: number of frames pushed at a time, frames are pushed one by one if it is 1
+    :param chunk_size: number of frames read from the session at a time
+    :return: points, offsets, side, origin, destination of the trials as in tra_store.save_trajectories,
+             latency: array of the time in seconds to push each batch
+    """
+    filename = os.path.join('./data/TwoOdor', csv_name)
+    ports, port_spread = get_session_ports(csv_name)
+    extractor = OnlineExtractor(ports)
+
+    trials = []
+    latency = []
+    for nose_x, nose_y in iter_session_chunks(filename, [('nose', 'x'), ('nose', 'y')], chunk_size):
+        if batch_size == 1:
+            for x, y in zip(nose_x.tolist(), nose_y.tolist()):
+                tic = time.perf_counter()
+                trial = extractor.push(x, y)
+                latency.append(time.perf_counter() - tic)
+                if trial is not None:
+                    trials.append(trial)
+        else:
+            for i in range(0, len(nose_x), batch_size):
+                tic = time.perf_counter()
+                trials.extend(extractor.push_batch(nose_x[i:i + batch_size], nose_y[i:i + batch_size]))
+                latency.append(time.perf_counter() - tic)
+
+    lengths = [len(points) for points, origin, destination in trials]
+    offsets = np.concatenate(([0], np.cumsum(lengths, dtype=int)))
+    points = np.concatenate([points for points, origin, destination in trials]) if trials else np.empty((0, 3))
+    origin = np.array([origin for points, origin, destination in trials], dtype=np.int16)
+    destination = np.array([destination for points, origin, destination in trials], dtype=np.int16)
+    side = get_side(ports, destination).astype(np.int8)
+    return points, offsets, side, origin, destination, np.array(latency)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='replay a recorded session through the online extractor, '
+                                                 'and check the trials against the offline extraction')
+    parser.add_argument('csv_name', help='name of the DLC csv file in ./data/TwoOdor')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='number of frames pushed at a time, one by one by default')
+    args = parser.parse_args()
+
+    trials = replay_session(args.csv_name, args.batch_size)
+    points, offsets, side, origin, destination, latency = trials
+    per_frame = latency / args.batch_size * 1e6
+    print(f'trajectories: {len(side)}, frames: {int(offsets[-1])}')
+    print(f'latency per frame (us): mean {per_frame.mean():.2f}, p99 {np.percentile(per_frame, 99):.2f}, '
+          f'max {per_frame.max():.2f}')
+
+    with tempfile.TemporaryDirectory() as tra_dict_path:
+        ports, port_spread = get_session_ports(args.csv_name)
+        extract_session(args.csv_name, ports, tra_dict_path)
+        expected = [np.array(a) for a in load_trajectories(tra_dict_path)] + list(load_trial_ports(tra_dict_path)[:2])
+    same = all(np.array_equal(a, b) for a, b in zip(trials[:5], expected))
+    print('same as offline extraction' if same else 'different from offline extraction')
@@ -1,20 +1,27 @@
-import numpy as np
 import os
-import matplotlib.pyplot as plt
-import scipy.stats
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+
+from stats import compare_groups
+
+matplotlib.rcParams.update({'font.size': 14})
+fig_dir = './figures'
 
-plt.rcParams.update({'font.size': 14})
 
+def get_fig_path(name, fig_format='pdf'):
+    return os.path.join(fig_dir, name + '.' + fig_format)
 
-def adjust_figure():
-    ax = plt.gca()
+
+def adjust_figure(ax):
     # Hide the right and top spines
     ax.spines['right'].set_visible(False)
     ax.spines['top'].set_visible(False)
     # Only show ticks on the left and bottom spines
     # ax.yaxis.set_ticks_position('left')
     # ax.xaxis.set_ticks_position('bottom')
-    plt.tight_layout(pad=0.5)
+    ax.figure.tight_layout(pad=0.5)
 
 
 def error_plot(x_axis,
@@ -26,7 +33,8 @@ def error_plot(x_axis,
                fig_name,
                test=False,
                test_group=(0, 1),
-               dh=0.05):
+               dh=0.05,
+               stats=None):
     """
     Plot error bar
     :param x_axis:
@@ -39,16 +47,19 @@ def error_plot(x_axis,
     :param test: whether to perform statistical test
     :param test_group: index of groups to perform test
     :param dh: height offset over bar / bar + yerr in axes coordinates (0 to 1)
+    :param stats: DataFrame made by stats.compare_groups of the test groups, one row per x position,
+                  computed from data_list if None
     :return:
     """
-    plt.figure()
+    fig = Figure()
+    ax = fig.subplots()
     for data, label, color in zip(data_list, label_list, color_list):
         mean = data.mean(axis=0)
         error = data.std(axis=0)
 
         # show errors as shaded regions
-        plt.plot(x_axis, mean, label=label, color=color)
-        plt.fill_between(
+        ax.plot(x_axis, mean, label=label, color=color)
+        ax.fill_between(
             x=x_axis,
             y1=mean - error,
             y2=mean + error,
@@ -59,29 +70,22 @@ def error_plot(x_axis,
 
     if test:
         # perform statistical test
-        ax_ymin, ax_ymax = plt.gca().get_ylim()
+        ax_ymin, ax_ymax = ax.get_ylim()
         dh *= (ax_ymax - ax_ymin)
 
-        p_value_list = []
-        max_mean_p_error = -np.inf
-        for i_x, x in enumerate(x_axis):
-            data1 = data_list[test_group[0]].iloc[:, i_x].dropna()
-            data2 = data_list[test_group[1]].iloc[:, i_x].dropna()
-            # Mann-Whitney U rank test
-            p_value_list.append(scipy.stats.mannwhitneyu(data1, data2).pvalue)
-
-            mean_p_error = max(data1.mean()+data1.std(), data2.mean()+data2.std())
-            if max_mean_p_error <= mean_p_error:
-                max_mean_p_error = mean_p_error
+        if stats is None:
+            stats = compare_groups(data_list[test_group[0]], data_list[test_group[1]])
+        # Mann-Whitney U rank test
+        p_value_list = stats['mannwhitneyu_p'].to_numpy()
+        max_mean_p_error = max((stats['mean1'] + stats['std1']).max(), (stats['mean2'] + stats['std2']).max())
         for x, p_value in zip(x_axis, p_value_list):
-            plt.text(x, max_mean_p_error + dh, get_stat_str(p_value), ha='center', va='bottom')
+            ax.text(x, max_mean_p_error + dh, get_stat_str(p_value), ha='center', va='bottom')
 
-    plt.legend()
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-    adjust_figure()
-    plt.savefig(os.path.join('./figures', fig_name+'.pdf'), transparent=True)
-    plt.close()
+    ax.legend()
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    adjust_figure(ax)
+    fig.savefig(get_fig_path(fig_name), transparent=True)
 
 
 def plot_trajectories(exp_name,
@@ -90,61 +94,71 @@ def plot_trajectories(exp_name,
                       leftport_pos,
                       rightport_pos,
                       left_avg_tra=None,
-                      right_avg_tra=None):
+                      right_avg_tra=None,
+                      rasterize=False,
+                      fig_format='pdf',
+                      dpi=300):
     """
-    Plot trajectories in a single video
+    Plot trajectories in a single video, trajectories of each side are drawn as a single line collection
+    :param left_tra_list: list of arrays of size (frames, 2 or more), the first two columns are x and y
+    :param right_tra_list: list of arrays of size (frames, 2 or more)
+    :param rasterize: whether to rasterize the trajectories in a vector figure, ports and text are kept as vectors
+    :param fig_format: format of the figure file, 'pdf' or 'png'
+    :param dpi: resolution of png figures and of rasterized trajectories
     """
     centerport_x, centerport_y = centerport_pos
     leftport_x, leftport_y = leftport_pos
     rightport_x, rightport_y = rightport_pos
 
-    plt.figure()
+    fig = Figure()
+    ax = fig.subplots()
     # plot multiple left tra
-    for tra in left_tra_list:
-        tra_zip = list(zip(*tra))
-        plt.plot(tra_zip[0], tra_zip[1], color='royalblue', alpha=0.1)
+    ax.add_collection(LineCollection([np.asarray(tra)[:, :2] for tra in left_tra_list],
+                                     colors='royalblue', alpha=0.1,
+                                     linewidths=matplotlib.rcParams['lines.linewidth'],
+                                     rasterized=rasterize))
 
     if left_avg_tra is not None:
-        plt.plot(left_avg_tra[:, 0], left_avg_tra[:, 1], color='k', linestyle='dashed')
+        ax.plot(left_avg_tra[:, 0], left_avg_tra[:, 1], color='k', linestyle='dashed')
     else:
         # line connecting ports
-        plt.plot([centerport_x, leftport_x], [centerport_y, leftport_y], 'k', linestyle='dashed')
+        ax.plot([centerport_x, leftport_x], [centerport_y, leftport_y], 'k', linestyle='dashed')
 
     # plot multiple right tra
-    for tra in right_tra_list:
-        tra_zip = list(zip(*tra))
-        plt.plot(tra_zip[0], tra_zip[1], color='deeppink', alpha=0.1)
+    ax.add_collection(LineCollection([np.asarray(tra)[:, :2] for tra in right_tra_list],
+                                     colors='deeppink', alpha=0.1,
+                                     linewidths=matplotlib.rcParams['lines.linewidth'],
+                                     rasterized=rasterize))
 
     if right_avg_tra is not None:
-        plt.plot(right_avg_tra[:, 0], right_avg_tra[:, 1], color='k', linestyle='dashed')
+        ax.plot(right_avg_tra[:, 0], right_avg_tra[:, 1], color='k', linestyle='dashed')
     else:
         # line connecting ports
-        plt.plot([centerport_x, rightport_x], [centerport_y, rightport_y], 'k', linestyle='dashed')
+        ax.plot([centerport_x, rightport_x], [centerport_y, rightport_y], 'k', linestyle='dashed')
 
     # show ports
     port_color = 'k'
     port_size = 200
-    plt.scatter(centerport_x, centerport_y, port_size, port_color)
-    plt.text(centerport_x + 3, centerport_y, 'center port')
-    plt.scatter(leftport_x, leftport_y, port_size, port_color)
-    plt.text(leftport_x, leftport_y + 2.5, 'left port')
-    plt.scatter(rightport_x, rightport_y, port_size, port_color)
-    plt.text(rightport_x, rightport_y + 2.5, 'right port')
-
-    plt.ylim([centerport_y - 5, centerport_y + 30])
-    plt.xlim([centerport_x - 60, centerport_x + 60])
-
-    plt.gca().invert_yaxis()
-    # plt.gca().set_aspect('equal')
-
-    plt.xlabel('X axis (pixels)')
-    plt.ylabel('Y axis (pixels)')
-    plt.title(f'mice/session: {exp_name}'
+    ax.scatter(centerport_x, centerport_y, port_size, port_color)
+    ax.text(centerport_x + 3, centerport_y, 'center port')
+    ax.scatter(leftport_x, leftport_y, port_size, port_color)
+    ax.text(leftport_x, leftport_y + 2.5, 'left port')
+    ax.scatter(rightport_x, rightport_y, port_size, port_color)
+    ax.text(rightport_x, rightport_y + 2.5, 'right port')
+
+    ax.set_ylim([centerport_y - 5, centerport_y + 30])
+    ax.set_xlim([centerport_x - 60, centerport_x + 60])
+
+    ax.invert_yaxis()
+    # ax.set_aspect('equal')
+
+    ax.set_xlabel('X axis (pixels)')
+    ax.set_ylabel('Y axis (pixels)')
+    ax.set_title(f'mice/session: {exp_name}'
               f'\n number of left trajectories: {len(left_tra_list)} '
               f'\n  number of right trajectories: {len(right_tra_list)}')
-    adjust_figure()
-    plt.savefig(os.path.join('./figures', exp_name+'_tra.pdf'), transparent=True)
-    plt.close()
+    adjust_figure(ax)
+    fig.savefig(get_fig_path(exp_name+'_tra', fig_format), transparent=True, dpi=dpi)
 
 
 def get_stat_str(p_value, maxasterix=None):
@@ -174,12 +188,13 @@ def get_stat_str(p_value, maxasterix=None):
     return text
 
 
-def barplot_annotate_brackets(idx1, idx2, data, center, height, yerr=None, dh=.05, barh=.05, fs=None):
+def barplot_annotate_brackets(ax, idx1, idx2, data, center, height, yerr=None, dh=.05, barh=.05, fs=None):
     """
     Annotate barplot with p-values.
     adapted from:
     https://stackoverflow.com/questions/11517986/indicating-the-statistically-significant-difference-in-bar-graph
 
+    :param ax: axes of the barplot
     :param idx1: index of left bar to put bracket over
     :param idx2: index of right bar to put bracket over
     :param data: string to write or number for generating asterixes
@@ -203,7 +218,7 @@ def barplot_annotate_brackets(idx1, idx2, data, center, height, yerr=None, dh=.0
         ly += yerr[idx1]
         ry += yerr[idx2]
 
-    ax_y0, ax_y1 = plt.gca().get_ylim()
+    ax_y0, ax_y1 = ax.get_ylim()
     dh *= (ax_y1 - ax_y0)
     barh *= (ax_y1 - ax_y0)
 
@@ -213,16 +228,16 @@ def barplot_annotate_brackets(idx1, idx2, data, center, height, yerr=None, dh=.0
     bary = [y, y+barh, y+barh, y]
     mid = ((lx+rx)/2, y+barh)
 
-    plt.plot(barx, bary, c='black')
+    ax.plot(barx, bary, c='black')
 
     kwargs = dict(ha='center', va='bottom')
     if fs is not None:
         kwargs['fontsize'] = fs
 
-    plt.text(*mid, text, **kwargs)
+    ax.text(*mid, text, **kwargs)
 
 
-def two_set_scatter_plot(data1, data2, labels, title_str, ylabel, save_str):
+def two_set_scatter_plot(data1, data2, labels, title_str, ylabel, save_str, stats=None):
     """
     scatter plot for two groups
         :param data1: pandas series for data group 1
@@ -231,29 +246,44 @@ def two_set_scatter_plot(data1, data2, labels, title_str, ylabel, save_str):
         :param title_str: string for title
         :param ylabel: y label string
         :param save_str: string to save
+        :param stats: row of the DataFrame made by stats.compare_groups, computed from data1 and data2 if None
     """
-    mean_data1 = data1.mean()
-    sem_data1 = data1.sem()
+    if stats is None:
+        stats = compare_groups(data1.to_frame('measure'), data2.to_frame('measure')).iloc[0]
+
+    mean_data1 = stats['mean1']
+    sem_data1 = stats['sem1']
     data1_x = [1, ] * len(data1)
 
-    mean_data2 = data2.mean()
-    sem_data2 = data2.sem()
+    mean_data2 = stats['mean2']
+    sem_data2 = stats['sem2']
     data2_x = [2, ] * len(data2)
 
     # Mann-Whitney U test, or Wilcoxon rank-sum test
-    p_value = scipy.stats.mannwhitneyu(data1.dropna(), data2.dropna()).pvalue
-    wilcoxon_p_value = scipy.stats.ranksums(data1.dropna(), data2.dropna()).pvalue
+    p_value = stats['mannwhitneyu_p']
+    wilcoxon_p_value = stats['ranksums_p']
 
     # Shapiro-Wilk test of normality
-    l_normal_p = scipy.stats.shapiro(data1.dropna()).pvalue
-    r_normal_p = scipy.stats.shapiro(data2.dropna()).pvalue
+    l_normal_p = stats['shapiro_p1']
+    r_normal_p = stats['shapiro_p2']
 
     # T-test
-    ttest_p_value = scipy.stats.ttest_ind(data1.dropna(), data2.dropna()).pvalue
-
-    plt.figure(figsize=(2.5, 5))
-    plt.scatter(data1_x, data1, 100, color='w', edgecolors='k', alpha=0.5)
-    plt.errorbar([1], mean_data1, yerr=sem_data1,
+    ttest_p_value = stats['ttest_p']
+
+    title_str = title_str \
+        + "\nMann-Whitney U test P = {:.3f}".format(p_value) \
+        + "\nWilcoxon rank-sum test P = {:.3f}".format(wilcoxon_p_value) \
+        + "\nNormality test (left, right) P = ({:.3f}, {:.3f})".format(l_normal_p, r_normal_p) \
+        + "\nT-test P = {:.3f}".format(ttest_p_value)
+    if 'permutation_p' in stats:
+        # permutation test and bootstrap confidence interval of the difference of means
+        title_str += "\nPermutation test P = {:.3f}".format(stats['permutation_p']) \
+            + "\nDiff. 95% CI = [{:.3g}, {:.3g}]".format(stats['mean_diff_ci_low'], stats['mean_diff_ci_high'])
+
+    fig = Figure(figsize=(2.5, 5))
+    ax = fig.subplots()
+    ax.scatter(data1_x, data1, 100, color='w', edgecolors='k', alpha=0.5)
+    ax.errorbar([1], mean_data1, yerr=sem_data1,
                  fmt="o",
                  mfc='white',
                  ecolor='k',
@@ -263,8 +293,8 @@ def two_set_scatter_plot(data1, data2, labels, title_str, ylabel, save_str):
                  markersize=10
                  )
 
-    plt.scatter(data2_x, data2, 100, color='mediumorchid', edgecolors='k', alpha=0.5)
-    plt.errorbar([2], mean_data2, yerr=sem_data2,
+    ax.scatter(data2_x, data2, 100, color='mediumorchid', edgecolors='k', alpha=0.5)
+    ax.errorbar([2], mean_data2, yerr=sem_data2,
                  fmt="o",
                  mfc='mediumorchid',
                  ecolor='k',
@@ -274,20 +304,15 @@ def two_set_scatter_plot(data1, data2, labels, title_str, ylabel, save_str):
                  markersize=10
                  )
 
-    plt.xticks([1, 2], labels, rotation=45)
-    plt.locator_params(nbins=5, axis='y')
-    plt.xlim([0.5, 2.5])
-    plt.title(title_str
-              + "\nMann-Whitney U test P = {:.3f}".format(p_value)
-              + "\nWilcoxon rank-sum test P = {:.3f}".format(wilcoxon_p_value)
-              + "\nNormality test (left, right) P = ({:.3f}, {:.3f})".format(l_normal_p, r_normal_p)
-              + "\nT-test P = {:.3f}".format(ttest_p_value),
-              fontsize=12)
-    plt.ylabel(ylabel)
-    barplot_annotate_brackets(0, 1, p_value, [1, 2],
+    ax.set_xticks([1, 2])
+    ax.set_xticklabels(labels, rotation=45)
+    ax.locator_params(nbins=5, axis='y')
+    ax.set_xlim([0.5, 2.5])
+    ax.set_title(title_str, fontsize=12)
+    ax.set_ylabel(ylabel)
+    barplot_annotate_brackets(ax, 0, 1, p_value, [1, 2],
                               [mean_data1, mean_data2],
-                              [data1.max()-mean_data1, data2.max()-mean_data1],
+                              [stats['max1']-mean_data1, stats['max2']-mean_data1],
                               barh=0.025)
-    adjust_figure()
-    plt.savefig(os.path.join('./figures/', save_str + '.pdf'), transparent=True, bbox_inches="tight")
-    plt.close()
+    adjust_figure(ax)
+    fig.savefig(get_fig_path(save_str), transparent=True, bbox_inches="tight")
@@ -0,0 +1,115 @@
+import itertools
+import numpy as np
+from scipy.spatial import cKDTree
+
+from dlc_csv import read_dlc_header
+
+kdtree_min_ports = 96  # ports are looked up in a k-d tree from this number of ports, and compared all at once below
+
+
+def get_port_names(filename):
+    """
+    get the names of the ports tracked in a DLC csv file, every body part whose name ends with 'port' is a port,
+    such as centerport, leftport and rightport
+    :return: list of names, in the order of the csv file
+    """
+    names = []
+    for bodypart, coord in read_dlc_header(filename):
+        if bodypart.endswith('port') and bodypart not in names:
+            names.append(bodypart)
+    return names
+
+
+def make_ports(names, positions, radius, spread=None):
+    """
+    make the port model of an arena
+    :param names: list of names of the ports
+    :param positions: list of (x, y) of the ports in pixels
+    :param radius: radius of every port in pixels, or dict of {name: radius}, the nose is in a port within its radius
+    :param spread: list of the spread of the tracked positions of each port in pixels, see make_dataframe.get_port_loc
+    :return: dict with names, positions: array of size (number of ports, 2), radius: float32 array,
+             spread: array, NaN if spread is None,
+             kdtree: k-d tree of the positions if there are at least kdtree_min_ports ports, None otherwise,
+             and kdtree_idx: index of the ports in the tree, ports that could not be located (NaN) are left out
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    if isinstance(radius, dict):
+        radius = [radius[name] for name in names]
+    radius = np.broadcast_to(np.asarray(radius, dtype=np.float32), (len(names),)).copy()
+    kdtree_idx = np.flatnonzero(np.isfinite(positions).all(axis=1))
+    return {
+        'names': list(names),
+        'positions': positions,
+        'radius': radius,
+        'spread': np.full(len(names), np.nan) if spread is None else np.asarray(spread, dtype=float),
+        'kdtree': cKDTree(positions[kdtree_idx]) if len(names) >= kdtree_min_ports else None,
+        'kdtree_idx': kdtree_idx,
+    }
+
+
+def get_port_position(ports, name):
+    """
+    get the position of a port by name
+    :return: tuple of (x, y) in pixels, or None if the port is not in the arena
+    """
+    if name not in ports['names']:
+        return None
+    x, y = ports['positions'][ports['names'].index(name)]
+    return float(x), float(y)
+
+
+def get_port_index(ports, names):
+    """
+    get the index of ports by name
+    :return: array of the index of each name, -1 for names that are not ports of the arena
+    """
+    return np.array([ports['names'].index(name) if name in ports['names'] else -1 for name in names], dtype=int)
+
+
+def nearest_port(x, y, ports):
+    """
+    find the port the nose is in at each frame, all ports are resolved at once, the nose is in a port when it is
+    within the radius of the port, and in the port it is relatively closest to (distance / radius) when it is within
+    the radius of several ports, ports that could not be located (NaN) never contain the nose
+    distances are computed in float32 like the tracking data, so a frame is in the same port whether it is looked up
+    alone or in an array
+    :param x: array of x positions of the nose
+    :param y: array of y positions of the nose
+    :param ports: dict made by make_ports
+    :return: int array, index of the port the nose is in at each frame, -1 if it is not in any port
+    """
+    x = np.asarray(x, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float32)
+    positions = ports['positions'].astype(np.float32)
+    radius = ports['radius']
+    port_idx = np.full(len(x), -1)
+    if len(positions) == 0:
+        return port_idx
+
+    if ports['kdtree'] is None:
+        # distances to all ports, size (frames, ports), NaN for positions or ports that are NaN
+        dist = np.sqrt((x[:, None] - positions[:, 0])**2 + (y[:, None] - positions[:, 1])**2)
+        with np.errstate(invalid='ignore'):
+            ratio = np.where(dist < radius, dist / radius, np.inf)
+        nearest = ratio.argmin(axis=1)
+        inside = np.isfinite(np.take_along_axis(ratio, nearest[:, None], axis=1)[:, 0])
+        port_idx[inside] = nearest[inside]
+        return port_idx
+
+    # the tree finds the candidate ports within the largest radius of each frame, the radius is widened a little
+    # so that no frame within the radius in float32 is missed, and distances are computed again in float32
+    finite = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    candidates = ports['kdtree'].query_ball_point(np.stack((x[finite], y[finite]), axis=1),
+                                                  r=float(radius.max()) * (1 + 1e-5))
+    counts = np.fromiter(map(len, candidates), dtype=int, count=len(candidates))
+    frame = np.repeat(finite, counts)
+    candidate = ports['kdtree_idx'][np.fromiter(itertools.chain.from_iterable(candidates), dtype=int,
+                                                count=counts.sum())]
+    dist = np.sqrt((x[frame] - positions[candidate, 0])**2 + (y[frame] - positions[candidate, 1])**2)
+    inside = dist < radius[candidate]
+    frame, candidate, ratio = frame[inside], candidate[inside], dist[inside] / radius[candidate[inside]]
+    # the relatively closest port of each frame, ties go to the first port like argmin
+    order = np.lexsort((candidate, ratio, frame))
+    first = order[np.unique(frame[order], return_index=True)[1]]
+    port_idx[frame[first]] = candidate[first]
+    return port_idx
@@ -0,0 +1,135 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from dlc_csv import read_dlc_header, read_dlc_csv, iter_dlc_csv
+
+cache_dir = './data/session_cache'
+
+
+def get_cache_path(filename):
+    """
+    get the cache directory of a DLC csv file, keyed by the absolute path of the source file
+    """
+    name = os.path.splitext(os.path.basename(filename))[0]
+    key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[:10]
+    return os.path.join(cache_dir, name + '_' + key)
+
+
+def get_source_info(filename):
+    stat = os.stat(filename)
+    return {'source': os.path.abspath(filename), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def get_columns(filename, bodyparts=None):
+    """
+    get the (bodypart, coord) columns of the given body parts in a DLC csv file, all columns if bodyparts is None
+    """
+    return [column for column in read_dlc_header(filename) if bodyparts is None or column[0] in bodyparts]
+
+
+def write_cache(filename, data):
+    """
+    add DLC tracking data into the cache, one float32 .npy file per (bodypart, coord) column
+    columns already in a valid cache are kept, so body parts can be cached as they are first needed
+    :param filename: path of the source csv file
+    :param data: dict of {(bodypart, coord): array}
+    """
+    cache_path = get_cache_path(filename)
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path)
+
+    meta = read_meta(filename) or get_source_info(filename)
+    columns = meta.get('columns', [])
+    for (bodypart, coord), array in data.items():
+        np.save(os.path.join(cache_path, f'{bodypart}_{coord}.npy'), np.asarray(array, dtype=np.float32))
+        if [bodypart, coord] not in columns:
+            columns.append([bodypart, coord])
+
+    # meta file is written last, so a partially written cache is never valid
+    meta['columns'] = columns
+    tmp_path = os.path.join(cache_path, 'meta.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(cache_path, 'meta.json'))
+
+
+def read_meta(filename):
+    """
+    read the meta data of the cache of a DLC csv file
+    :return: dict, or None if the cache is missing or outdated
+    """
+    meta_path = os.path.join(get_cache_path(filename), 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    source_info = get_source_info(filename)
+    if any(meta[key] != source_info[key] for key in source_info):
+        return None
+    return meta
+
+
+def read_cache(filename, columns, mmap_mode=None):
+    """
+    read DLC tracking data from the cache
+    :param columns: list of (bodypart, coord) columns to read
+    :param mmap_mode: mmap_mode of np.load, arrays are read into memory if None
+    :return: dict of {(bodypart, coord): array}, or None if any of the columns is not in a valid cache
+    """
+    meta = read_meta(filename)
+    if meta is None:
+        return None
+    cached = set(tuple(column) for column in meta['columns'])
+    if any(tuple(column) not in cached for column in columns):
+        return None
+
+    cache_path = get_cache_path(filename)
+    return {(bodypart, coord): np.load(os.path.join(cache_path, f'{bodypart}_{coord}.npy'), mmap_mode=mmap_mode)
+            for bodypart, coord in columns}
+
+
+def load_session(filename, bodyparts=None, mmap_mode=None):
+    """
+    load DLC tracking data of a session, only the body parts missing from the cache are parsed from the csv file
+    :param filename: path of the DLC csv file
+    :param bodyparts: list of body parts to load, all body parts if None
+    :param mmap_mode: mmap_mode of np.load, arrays are read into memory if None
+    :return: dict of {(bodypart, coord): float32 array}, coord is x, y or likelihood
+    """
+    columns = get_columns(filename, bodyparts)
+    data = read_cache(filename, columns, mmap_mode)
+    if data is None:
+        meta = read_meta(filename)
+        cached = set(tuple(column) for column in meta['columns']) if meta is not None else set()
+        missing = sorted(set(bodypart for bodypart, coord in columns if (bodypart, coord) not in cached))
+        write_cache(filename, read_dlc_csv(filename, missing))
+        data = read_cache(filename, columns, mmap_mode)
+    return data
+
+
+def iter_session_chunks(filename, columns, chunk_size=None):
+    """
+    iterate over consecutive chunks of frames of DLC tracking data, to bound the memory used by long recordings
+    chunks are sliced from the memory-mapped cache if it is valid, otherwise they are parsed from the csv file
+    :param filename: path of the DLC csv file
+    :param columns: list of (bodypart, coord) columns to load
+    :param chunk_size: number of frames in each chunk, the whole session is loaded as a single chunk if None
+    :return: iterator of tuples of float32 arrays, one for each of the columns
+    """
+    bodyparts = sorted(set(bodypart for bodypart, coord in columns))
+    if chunk_size is None:
+        data = load_session(filename, bodyparts)
+        yield tuple(data[tuple(column)] for column in columns)
+        return
+
+    arrays = read_cache(filename, columns, mmap_mode='r')
+    if arrays is not None:
+        arrays = [arrays[tuple(column)] for column in columns]
+        for start in range(0, len(arrays[0]), chunk_size):
+            yield tuple(np.array(array[start:start + chunk_size]) for array in arrays)
+    else:
+        for data in iter_dlc_csv(filename, bodyparts, chunk_size):
+            yield tuple(data[tuple(column)] for column in columns)
@@ -0,0 +1,169 @@
+import os
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+from manifest import get_hash
+
+stats_dir = './data/group_stats'
+
+
+def mannwhitneyu(x1, x2):
+    """
+    Mann-Whitney U test of every column, with the method chosen for each column as method='auto' of
+    scipy.stats.mannwhitneyu does for a single column: the exact distribution for small samples without ties
+    :param x1: array of group 1, size (samples, measures), NaN are left out
+    :param x2: array of group 2, size (samples, measures)
+    :return: array of p values
+    """
+    n1 = (~np.isnan(x1)).sum(axis=0)
+    n2 = (~np.isnan(x2)).sum(axis=0)
+    # NaN are sorted to the end, and never equal to their neighbors
+    pooled = np.sort(np.concatenate((x1, x2)), axis=0)
+    has_ties = (np.diff(pooled, axis=0) == 0).any(axis=0)
+    exact = ((n1 <= 8) | (n2 <= 8)) & ~has_ties
+
+    p_values = np.full(x1.shape[1], np.nan)
+    for method, idx in (('exact', exact), ('asymptotic', ~exact)):
+        if idx.any():
+            p_values[idx] = scipy.stats.mannwhitneyu(x1[:, idx], x2[:, idx], axis=0, nan_policy='omit',
+                                                     method=method).pvalue
+    return p_values
+
+
+def get_mean_diff(values1, values2):
+    """
+    difference of the means of two groups along axis -2, NaN are left out
+    :param values1: array of group 1, size (..., samples, measures)
+    :param values2: array of group 2, size (..., samples, measures)
+    :return: array of size (..., measures)
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean1 = np.nansum(values1, axis=-2) / (~np.isnan(values1)).sum(axis=-2)
+        mean2 = np.nansum(values2, axis=-2) / (~np.isnan(values2)).sum(axis=-2)
+    return mean1 - mean2
+
+
+def permutation_test(x1, x2, n_resamples=10000, chunk_size=1000, seed=0):
+    """
+    two-sided permutation test of the difference of means of every column, the group labels of samples
+    are shuffled by a matrix of permuted indices, chunk_size permutations at a time to bound the memory
+    :param x1: array of group 1, size (samples, measures), NaN are left out
+    :param x2: array of group 2, size (samples, measures)
+    :param n_resamples: number of permutations
+    :param chunk_size: number of permutations processed at a time
+    :param seed: seed of the random number generator
+    :return: array of p values
+    """
+    rng = np.random.default_rng(seed)
+    pooled = np.concatenate((x1, x2))
+    n1 = len(x1)
+    observed = np.abs(get_mean_diff(x1, x2))
+
+    n_extreme = np.zeros(x1.shape[1])
+    for start in range(0, n_resamples, chunk_size):
+        n_chunk = min(chunk_size, n_resamples - start)
+        perm_idx = rng.permuted(np.tile(np.arange(len(pooled)), (n_chunk, 1)), axis=1)
+        resampled = pooled[perm_idx]  # size (n_chunk, samples, measures)
+        diff = np.abs(get_mean_diff(resampled[:, :n1], resampled[:, n1:]))
+        # small tolerance, so permutations equal to the observed data count as extreme despite rounding
+        n_extreme += (diff >= observed * (1 - 1e-12)).sum(axis=0)
+    p_values = (n_extreme + 1) / (n_resamples + 1)
+    p_values[np.isnan(observed)] = np.nan
+    return p_values
+
+
+def bootstrap_ci(x1, x2, n_resamples=10000, confidence=0.95, chunk_size=1000, seed=0):
+    """
+    percentile bootstrap confidence interval of the difference of means of every column,
+    samples of each group are drawn with replacement by a matrix of indices, chunk_size resamples at a time
+    :param x1: array of group 1, size (samples, measures), NaN are left out
+    :param x2: array of group 2, size (samples, measures)
+    :param n_resamples: number of bootstrap resamples
+    :param confidence: confidence level of the interval
+    :param chunk_size: number of resamples processed at a time
+    :param seed: seed of the random number generator
+    :return: low, high: arrays of the bounds of the interval
+    """
+    rng = np.random.default_rng(seed)
+    diff = np.empty((n_resamples, x1.shape[1]))
+    for start in range(0, n_resamples, chunk_size):
+        n_chunk = min(chunk_size, n_resamples - start)
+        idx1 = rng.integers(0, len(x1), (n_chunk, len(x1)))
+        idx2 = rng.integers(0, len(x2), (n_chunk, len(x2)))
+        diff[start:start + n_chunk] = get_mean_diff(x1[idx1], x2[idx2])
+    alpha = (1 - confidence) / 2
+    low, high = np.nanquantile(diff, [alpha, 1 - alpha], axis=0)
+    return low, high
+
+
+def compare_groups(data1, data2, n_resamples=10000, seed=0):
+    """
+    compare two groups on every measure, each test runs once along the samples axis for all measures
+    :param data1: DataFrame of group 1, size (samples, measures), NaN are left out
+    :param data2: DataFrame of group 2, with the same columns as data1
+    :param n_resamples: number of resamples of the permutation test and the bootstrap, they are skipped if 0
+    :param seed: seed of the random number generator of resampling
+    :return: DataFrame indexed by measure, with the size, mean, standard deviation, sem and max of each group,
+             and p values of Mann-Whitney U test, Wilcoxon rank-sum test, Shapiro-Wilk test of each group and T-test,
+             and the difference of means with its permutation test p value and 95% bootstrap confidence interval
+    """
+    x1 = data1.to_numpy(dtype=float)
+    x2 = data2.loc[:, data1.columns].to_numpy(dtype=float)
+
+    stats = pd.DataFrame(index=data1.columns)
+    stats.index.name = 'measure'
+    for i_group, x in ((1, x1), (2, x2)):
+        n = (~np.isnan(x)).sum(axis=0)
+        stats[f'n{i_group}'] = n
+        stats[f'mean{i_group}'] = np.nanmean(x, axis=0)
+        stats[f'std{i_group}'] = np.nanstd(x, axis=0, ddof=1)
+        stats[f'sem{i_group}'] = stats[f'std{i_group}'] / np.sqrt(n)
+        stats[f'max{i_group}'] = np.nanmax(x, axis=0)
+
+    # Mann-Whitney U test, or Wilcoxon rank-sum test
+    stats['mannwhitneyu_p'] = mannwhitneyu(x1, x2)
+    stats['ranksums_p'] = scipy.stats.ranksums(x1, x2, axis=0, nan_policy='omit').pvalue
+    # Shapiro-Wilk test of normality
+    stats['shapiro_p1'] = scipy.stats.shapiro(x1, axis=0, nan_policy='omit').pvalue
+    stats['shapiro_p2'] = scipy.stats.shapiro(x2, axis=0, nan_policy='omit').pvalue
+    # T-test
+    stats['ttest_p'] = scipy.stats.ttest_ind(x1, x2, axis=0, nan_policy='omit').pvalue
+
+    if n_resamples > 0:
+        # samples without any measure, such as sessions without tracking data, are not resampled
+        x1 = x1[~np.isnan(x1).all(axis=1)]
+        x2 = x2[~np.isnan(x2).all(axis=1)]
+        stats['mean_diff'] = stats['mean1'] - stats['mean2']
+        stats['permutation_p'] = permutation_test(x1, x2, n_resamples, seed=seed)
+        stats['mean_diff_ci_low'], stats['mean_diff_ci_high'] = bootstrap_ci(x1, x2, n_resamples, seed=seed)
+    return stats
+
+
+def compare_groupings(groupings, n_resamples=10000, seed=0):
+    """
+    compare two groups on every measure for each grouping of samples, see compare_groups
+    :param groupings: dict of {grouping name: (data1, data2)}
+    :return: DataFrame indexed by (grouping, measure)
+    """
+    return pd.concat({name: compare_groups(data1, data2, n_resamples, seed)
+                      for name, (data1, data2) in groupings.items()},
+                     names=['grouping'])
+
+
+def load_group_stats(groupings, n_resamples=10000, seed=0):
+    """
+    compare the groupings, see compare_groupings, the results are cached in ./data/group_stats
+    keyed by a hash of the data, so they are only computed again when the data changes
+    :return: DataFrame indexed by (grouping, measure)
+    """
+    data_hash = get_hash({name: [data1.to_csv(), data2.to_csv()] for name, (data1, data2) in groupings.items()},
+                         n_resamples, seed)
+    stats_path = os.path.join(stats_dir, data_hash + '.csv')
+    if os.path.exists(stats_path):
+        return pd.read_csv(stats_path, index_col=[0, 1], float_precision='round_trip')
+
+    stats = compare_groupings(groupings, n_resamples, seed)
+    os.makedirs(stats_dir, exist_ok=True)
+    stats.to_csv(stats_path)
+    return stats
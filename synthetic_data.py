@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+scorer = 'DLC_resnet50_RIMdataSep11shuffle1_500000'
+
+
+def get_path(p0, p1, n_frames, bend=0.0):
+    """
+    get a curved path from p0 to p1, a quadratic bezier curve with the control point shifted off the straight line
+    :param bend: shift of the control point perpendicular to the line, in proportion of the length of the line
+    :return: array of size (n_frames, 2)
+    """
+    p0 = np.asarray(p0, dtype=float)
+    p1 = np.asarray(p1, dtype=float)
+    normal = np.array([p0[1] - p1[1], p1[0] - p0[0]])
+    control = (p0 + p1) / 2 + bend * normal
+    t = np.linspace(0, 1, n_frames)[:, None]
+    return (1 - t) ** 2 * p0 + 2 * (1 - t) * t * control + t ** 2 * p1
+
+
+def make_nose_track(n_frames, n_trials, centerport, leftport, rightport, abort_rate=0.2, rng=None):
+    """
+    simulate the nose moving between ports, each trial is a stay in the center port, a run to a side port,
+    a stay in the side port and a run back, the frames left are spent away from the ports between trials
+    :param abort_rate: probability that the mouse turns back to the center port half way of a trial
+    :return: array of size (n_frames, 2), noiseless nose positions in pixels
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    centerport = np.asarray(centerport, dtype=float)
+    segments = []
+    for i_trial in range(n_trials):
+        side_port = np.asarray(leftport if rng.random() < 0.5 else rightport, dtype=float)
+        segments.append(np.repeat(centerport[None, :], rng.integers(5, 40), axis=0))
+        if rng.random() < abort_rate:
+            # turn back to the center port half way
+            half_way = centerport + (side_port - centerport) * rng.uniform(0.3, 0.7)
+            segments.append(get_path(centerport, half_way, rng.integers(10, 100), rng.normal(0, 0.2)))
+            segments.append(get_path(half_way, centerport, rng.integers(10, 100), rng.normal(0, 0.2)))
+        else:
+            segments.append(get_path(centerport, side_port, rng.integers(15, 150), rng.normal(0, 0.2)))
+            segments.append(np.repeat(side_port[None, :], rng.integers(5, 40), axis=0))
+            segments.append(get_path(side_port, centerport, rng.integers(15, 150), rng.normal(0, 0.2)))
+    track = np.concatenate(segments) if segments else np.empty((0, 2))
+
+    if len(track) < n_frames:
+        # spread the frames left between trials, staying at a random place away from the ports
+        n_idle = n_frames - len(track)
+        idle_pos = centerport + rng.uniform([-60, 10], [60, 40])
+        idle_track = np.repeat(idle_pos[None, :], n_idle, axis=0)
+        track = np.concatenate((idle_track[:n_idle // 2], track, idle_track[n_idle // 2:]))
+    return track[:n_frames]
+
+
+def make_dlc_data(n_frames=10000,
+                  n_trials=None,
+                  noise=0.5,
+                  dropout_rate=0.01,
+                  centerport=(200.0, 100.0),
+                  leftport=(150.0, 120.0),
+                  rightport=(250.0, 120.0),
+                  seed=None):
+    """
+    make DeepLabCut style tracking data of a session, with body parts nose, centerport, leftport and rightport
+    :param n_frames: number of frames
+    :param n_trials: number of center -> side port trials, about one trial per 300 frames if None
+    :param noise: standard deviation of the tracking noise, in pixels
+    :param dropout_rate: proportion of frames where tracking fails, with a low likelihood and a jump of position
+    :param centerport: coordinate of the center port
+    :param leftport: coordinate of the left port
+    :param rightport: coordinate of the right port
+    :param seed: seed of the random number generator
+    :return: DataFrame with (scorer, bodyparts, coords) columns
+    """
+    rng = np.random.default_rng(seed)
+    if n_trials is None:
+        n_trials = n_frames // 300
+
+    positions = {
+        'nose': make_nose_track(n_frames, n_trials, centerport, leftport, rightport, rng=rng),
+        'centerport': np.repeat(np.array(centerport, dtype=float)[None, :], n_frames, axis=0),
+        'leftport': np.repeat(np.array(leftport, dtype=float)[None, :], n_frames, axis=0),
+        'rightport': np.repeat(np.array(rightport, dtype=float)[None, :], n_frames, axis=0),
+    }
+
+    data = {}
+    for bodypart, xy in positions.items():
+        xy = xy + rng.normal(0, noise, xy.shape)
+        likelihood = rng.uniform(0.95, 1.0, n_frames)
+        # tracking failures
+        dropout = rng.random(n_frames) < dropout_rate
+        xy[dropout] += rng.normal(0, 30, (dropout.sum(), 2))
+        likelihood[dropout] = rng.uniform(0.0, 0.5, dropout.sum())
+
+        data[(scorer, bodypart, 'x')] = xy[:, 0]
+        data[(scorer, bodypart, 'y')] = xy[:, 1]
+        data[(scorer, bodypart, 'likelihood')] = likelihood
+
+    data = pd.DataFrame(data)
+    data.columns.names = ['scorer', 'bodyparts', 'coords']
+    return data
+
+
+def write_dlc_csv(filename, **kwargs):
+    """
+    write a DeepLabCut style csv file of a simulated session, see make_dlc_data for keyword arguments
+    """
+    make_dlc_data(**kwargs).to_csv(filename)
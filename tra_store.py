@@ -0,0 +1,123 @@
+import os
+import json
+import numpy as np
+
+
+def save_trajectories(path, points, offsets, side, bodyparts=None, origin=None, destination=None, port_names=None):
+    """
+    save trajectories of a session as a ragged array
+    :param path: directory to save the trajectories
+    :param points: array of size (total number of points, 3), x, y positions in pixels and frame index
+    :param offsets: array of size (number of trajectories + 1), trajectory i is points[offsets[i]:offsets[i+1]]
+    :param side: array of size (number of trajectories), 0 for left trajectories, 1 for right trajectories,
+                 -1 for trajectories to other ports
+    :param bodyparts: dict of {(bodypart, coord): array of size (total number of points)}, other body parts
+                      at the frames of points
+    :param origin: array of size (number of trajectories), index of the port where each trajectory started
+    :param destination: array of size (number of trajectories), index of the port where each trajectory ended
+    :param port_names: list of names of the ports indexed by origin and destination
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    np.save(os.path.join(path, 'points.npy'), np.asarray(points, dtype=np.float64))
+    np.save(os.path.join(path, 'offsets.npy'), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(path, 'side.npy'), np.asarray(side, dtype=np.int8))
+
+    bodyparts = {} if bodyparts is None else bodyparts
+    for (bodypart, coord), values in bodyparts.items():
+        np.save(os.path.join(path, f'{bodypart}_{coord}.npy'), np.asarray(values, dtype=np.float32))
+    with open(os.path.join(path, 'bodyparts.json'), 'w') as f:
+        json.dump([[bodypart, coord] for bodypart, coord in bodyparts], f)
+
+    if origin is not None:
+        np.save(os.path.join(path, 'origin.npy'), np.asarray(origin, dtype=np.int16))
+        np.save(os.path.join(path, 'destination.npy'), np.asarray(destination, dtype=np.int16))
+        with open(os.path.join(path, 'ports.json'), 'w') as f:
+            json.dump(list(port_names), f)
+
+
+def load_trajectories(path, mmap_mode='r'):
+    """
+    load the ragged array of trajectories of a session, memory-mapped by default
+    :return: points, offsets, side, see save_trajectories
+    """
+    points = np.load(os.path.join(path, 'points.npy'), mmap_mode=mmap_mode)
+    offsets = np.load(os.path.join(path, 'offsets.npy'))
+    side = np.load(os.path.join(path, 'side.npy'))
+    return points, offsets, side
+
+
+def load_bodyparts(path, mmap_mode='r'):
+    """
+    load the other body parts recorded with the trajectories of a session, memory-mapped by default
+    :return: dict of {(bodypart, coord): array}, in the same ragged layout as points, see save_trajectories
+    """
+    bodyparts_path = os.path.join(path, 'bodyparts.json')
+    if not os.path.exists(bodyparts_path):
+        return {}
+    with open(bodyparts_path) as f:
+        columns = json.load(f)
+    return {(bodypart, coord): np.load(os.path.join(path, f'{bodypart}_{coord}.npy'), mmap_mode=mmap_mode)
+            for bodypart, coord in columns}
+
+
+def load_trial_ports(path):
+    """
+    load the ports where the trajectories of a session started and ended
+    :return: origin, destination: arrays of port index, port_names: list of names of the ports,
+             or None if they were not saved, see save_trajectories
+    """
+    ports_path = os.path.join(path, 'ports.json')
+    if not os.path.exists(ports_path):
+        return None
+    with open(ports_path) as f:
+        port_names = json.load(f)
+    origin = np.load(os.path.join(path, 'origin.npy'))
+    destination = np.load(os.path.join(path, 'destination.npy'))
+    return origin, destination, port_names
+
+
+def split_trajectories(points, offsets):
+    """
+    split the ragged array into a list of trajectories, each one is a view of points
+    """
+    return [points[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def select_trajectories(points, offsets, idx):
+    """
+    select trajectories of a ragged array
+    :param idx: array of the index of the trajectories to select
+    :return: points, offsets: the selected trajectories as a ragged array of their own
+    """
+    offsets = np.asarray(offsets)
+    idx = np.asarray(idx, dtype=np.int64)
+    lengths = offsets[idx + 1] - offsets[idx]
+    new_offsets = np.concatenate(([0], np.cumsum(lengths)))
+    point_idx = np.repeat(offsets[idx] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return np.asarray(points)[point_idx], new_offsets
+
+
+def get_side_names(side):
+    """
+    get the name of the side of trajectories
+    :return: array of 'left' or 'right', 'other' for trajectories to other ports
+    """
+    side = np.asarray(side)
+    return np.array(['left', 'right', 'other'])[np.where(side >= 0, side, 2)]
+
+
+def load_tra_dict(path):
+    """
+    load trajectories of a session
+    :return: dict of lists of trajectories with keys 'left_tra', 'right_tra' and 'all_tra',
+             each trajectory is an array of size (trajectory length, 3) viewing the memory-mapped file
+    """
+    points, offsets, side = load_trajectories(path)
+    all_tra = split_trajectories(points, offsets)
+    tra_dict = {
+        'left_tra': [tra for tra, s in zip(all_tra, side) if s == 0],
+        'right_tra': [tra for tra, s in zip(all_tra, side) if s == 1],
+        'all_tra': all_tra,
+    }
+    return tra_dict